@@ -0,0 +1,175 @@
+#!/usr/bin/env python
+'''Microbenchmarks for the parsing and status functions of twitchapi.
+
+Generates synthetic wtwitch config, subscription cache, lastSeen and VOD
+files in a temporary directory and prints the results as JSON, e.g.:
+
+    python benchmarks/bench_twitchapi.py --sizes 100,1000 --output bench.json
+'''
+
+import os
+import sys
+import json
+import time
+import random
+import shutil
+import argparse
+import platform
+import tempfile
+import tracemalloc
+import subprocess
+
+repo_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+def generate_files(workdir, follows, online_share=0.2, seed=1):
+    '''Writes config.json, subscription-cache.json and the lastSeen files for
+    the given number of follows. Returns the followed logins.
+    '''
+    rng = random.Random(seed)
+    logins = [f'streamer_{i:05d}' for i in range(follows)]
+    config_dir = os.path.join(workdir, 'config', 'wtwitch')
+    cache_dir = os.path.join(workdir, 'cache', 'wtwitch')
+    lastseen_dir = os.path.join(cache_dir, 'lastSeen')
+    shutil.rmtree(lastseen_dir, ignore_errors=True)
+    os.makedirs(config_dir, exist_ok=True)
+    os.makedirs(lastseen_dir, exist_ok=True)
+    config = {'player': 'mpv',
+                'quality': 'best',
+                'colors': 'true',
+                'printOfflineSubscriptions': 'true',
+                'subscriptions': [{'streamer': login} for login in logins]
+                }
+    with open(os.path.join(config_dir, 'config.json'), 'w') as config_file:
+        json.dump(config, config_file)
+    online = rng.sample(logins, int(follows * online_share))
+    streams = [{'user_login': login,
+                'user_name': login.title(),
+                'game_name': rng.choice(['Chess', 'Just Chatting', 'Music',
+                                        'Science & Technology']),
+                'title': f'Stream of {login} #{rng.randint(1, 999)}',
+                'viewer_count': rng.randint(0, 50000),
+                'thumbnail_url': f'https://example.invalid/{login}'
+                                '-{width}x{height}.jpg'
+                } for login in online]
+    with open(os.path.join(cache_dir, 'subscription-cache.json'), 'w') as cache:
+        json.dump({'data': streams}, cache)
+    for login in logins:
+        with open(os.path.join(lastseen_dir, login), 'w') as lastseen:
+            lastseen.write(str(1700000000 + rng.randint(0, 10000000)))
+    return logins
+
+def vod_output(count):
+    '''Returns synthetic wtwitch v output with ANSI colors.
+    '''
+    lines = [' \x1b[1mVODs:\x1b[0m']
+    for i in range(1, count + 1):
+        lines.append(f' {i}. 10/{i % 28 + 1:02d} 18:{i % 60:02d}\x1b[0m '
+                    f'VOD title number {i} \x1b[93m{i % 9}h{i % 60:02d}m'
+                    '\x1b[0m')
+    return lines
+
+def measure(function, repeat):
+    '''Returns the best duration of repeat runs and the peak memory of the
+    first run.
+    '''
+    tracemalloc.start()
+    function()
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    best = None
+    for _ in range(repeat):
+        started = time.perf_counter()
+        function()
+        duration = time.perf_counter() - started
+        if best is None or duration < best:
+            best = duration
+    return best, peak
+
+def run_benchmarks(twitchapi, size, repeat):
+    results = []
+    def record(name, items, function):
+        seconds, peak = measure(function, repeat)
+        results.append({'name': name,
+                        'size': size,
+                        'seconds': seconds,
+                        'items_per_second': items / seconds if seconds else None,
+                        'peak_bytes': peak
+                        })
+
+    def extract_cold():
+        twitchapi.config_cache['key'] = None
+        twitchapi.status_cache['key'] = None
+        twitchapi.extract_streamer_status()
+    record('extract_streamer_status (cold)', size, extract_cold)
+    record('extract_streamer_status (cached)', size,
+            twitchapi.extract_streamer_status)
+
+    lines = vod_output(size)
+    record('parse_vods', size, lambda: twitchapi.parse_vods(lines))
+
+    logins = [package.login for package
+                in sum(twitchapi.extract_streamer_status(), ())]
+    def last_seen_cold():
+        twitchapi.last_seen_index['key'] = None
+        twitchapi.last_seen_index['files'] = {}
+        twitchapi.last_seen_index['checked'] = 0
+        for login in logins:
+            twitchapi.last_seen(login)
+    record('last_seen (cold)', size, last_seen_cold)
+    def last_seen_warm():
+        for login in logins:
+            twitchapi.last_seen(login)
+    record('last_seen (indexed)', size, last_seen_warm)
+
+    def follow_and_unfollow():
+        twitchapi.follow_streamer('benchmark_follow')
+        twitchapi.unfollow_streamer('benchmark_follow')
+    record('follow_streamer + unfollow_streamer', 2, follow_and_unfollow)
+    return results
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--sizes', default='100,1000,5000,20000',
+                        help='comma separated follow list sizes')
+    parser.add_argument('--repeat', type=int, default=5,
+                        help='timed runs per benchmark, the best one counts')
+    parser.add_argument('--output', help='write the JSON here, not stdout')
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix='wince-bench-')
+    os.environ['XDG_CONFIG_HOME'] = os.path.join(workdir, 'config')
+    os.environ['XDG_CACHE_HOME'] = os.path.join(workdir, 'cache')
+    os.environ.pop('APPDATA', None)
+    os.environ.pop('LOCALAPPDATA', None)
+    # twitchapi keeps settings.json and the VOD cache in sys.path[0]:
+    sys.path[0:1] = [workdir, repo_dir]
+    with open(os.path.join(workdir, 'settings.json'), 'w') as settings:
+        settings.write('{"show_info": "no", "show_info_preset": "online"}')
+    import twitchapi
+
+    results = []
+    try:
+        for size in [int(size) for size in args.sizes.split(',')]:
+            generate_files(workdir, size)
+            results += run_benchmarks(twitchapi, size, args.repeat)
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+    try:
+        revision = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'],
+                                capture_output=True, text=True,
+                                cwd=repo_dir).stdout.strip()
+    except OSError:
+        revision = None
+    report = {'revision': revision,
+                'python': platform.python_version(),
+                'platform': platform.platform(),
+                'results': results
+                }
+    if args.output:
+        with open(args.output, 'w') as output:
+            json.dump(report, output, indent=2)
+    else:
+        print(json.dumps(report, indent=2))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,104 @@
+#!/usr/bin/env python
+'''Stand-in for the Twitch Helix API, for testing the helix status backend
+without Twitch. Answers GET /helix/streams with up to 100 user_login
+parameters over kept-alive connections, e.g.:
+
+    python benchmarks/fake_helix.py --port 8766 --online-share 0.2
+
+and in settings.json:
+
+    "status_backend": "helix",
+    "helix_url": "http://127.0.0.1:8766/helix",
+    "helix_client_id": "fake-client",
+    "helix_token": "fake-token"
+
+Wrong credentials get 401, like on Twitch.
+'''
+
+import sys
+import json
+import time
+import zlib
+import random
+import argparse
+from urllib.parse import urlsplit, parse_qs
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+def is_online(login, share):
+    # Stable per login, so consecutive refreshes agree:
+    return zlib.crc32(login.encode()) % 1000 < share * 1000
+
+def stream(login):
+    number = zlib.crc32(login.encode())
+    return {'user_login': login,
+            'user_name': login,
+            'game_name': ['Chess', 'Just Chatting', 'Music'][number % 3],
+            'title': f'Fake Helix stream of {login}',
+            'viewer_count': number % 20000,
+            'thumbnail_url': f'http://127.0.0.1:1/{login}'
+                            '-{width}x{height}.jpg'
+            }
+
+def handler(args):
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = 'HTTP/1.1'
+
+        def do_GET(self):
+            time.sleep(args.latency)
+            url = urlsplit(self.path)
+            if url.path != '/helix/streams':
+                self.answer(404, {'error': 'Not Found'})
+            elif (self.headers.get('Client-Id') != args.client_id
+                    or self.headers.get('Authorization')
+                        != f'Bearer {args.token}'):
+                self.answer(401, {'error': 'Unauthorized',
+                                    'message': 'Invalid OAuth token'})
+            elif random.random() < args.fail_rate:
+                self.answer(503, {'error': 'Service Unavailable'})
+            else:
+                logins = parse_qs(url.query).get('user_login', [])
+                if len(logins) > 100:
+                    self.answer(400, {'error': 'Bad Request',
+                                        'message': 'too many user_login'})
+                    return
+                self.answer(200, {'data': [stream(login) for login in logins
+                                            if is_online(login,
+                                                        args.online_share)],
+                                    'pagination': {}})
+
+        def answer(self, status, data):
+            body = json.dumps(data).encode()
+            self.send_response(status)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *log_args):
+            if args.verbose:
+                super().log_message(*log_args)
+    return Handler
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--port', type=int, default=8766)
+    parser.add_argument('--online-share', type=float, default=0.2,
+                        help='share of the requested logins that are live')
+    parser.add_argument('--client-id', default='fake-client')
+    parser.add_argument('--token', default='fake-token')
+    parser.add_argument('--latency', type=float, default=0.0,
+                        help='seconds to wait before each answer')
+    parser.add_argument('--fail-rate', type=float, default=0.0,
+                        help='share of requests answered with HTTP 503')
+    parser.add_argument('--verbose', action='store_true')
+    args = parser.parse_args()
+    server = ThreadingHTTPServer(('127.0.0.1', args.port), handler(args))
+    print(f'Serving Helix on http://127.0.0.1:{args.port}/helix',
+            file=sys.stderr)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+if __name__ == '__main__':
+    main()
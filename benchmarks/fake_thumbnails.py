@@ -0,0 +1,95 @@
+#!/usr/bin/env python
+'''Stand-in for the Twitch thumbnail host, for testing the thumbnail cache
+without Twitch. Serves a small generated image for every path, a JPEG
+like Twitch for paths ending in .jpg, if Pillow is installed, e.g.:
+
+    python benchmarks/fake_thumbnails.py --port 8765 --latency 2 --fail-rate 0.2
+    FAKE_WTWITCH_THUMBNAILS=http://127.0.0.1:8765 python benchmarks/gui_harness.py
+
+The fake wtwitch puts $FAKE_WTWITCH_THUMBNAILS into the thumbnail URLs.
+'''
+
+import sys
+import time
+import zlib
+import random
+import struct
+import argparse
+from io import BytesIO
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+try:
+    from PIL import Image
+except ImportError:
+    Image = None
+
+def png(width, height, color):
+    '''Returns a PNG of one color.
+    '''
+    def chunk(kind, data):
+        return (struct.pack('>I', len(data)) + kind + data
+                + struct.pack('>I', zlib.crc32(kind + data)))
+    row = b'\x00' + bytes(color) * width
+    return (b'\x89PNG\r\n\x1a\n'
+            + chunk(b'IHDR', struct.pack('>IIBBBBB', width, height, 8, 2,
+                                        0, 0, 0))
+            + chunk(b'IDAT', zlib.compress(row * height))
+            + chunk(b'IEND', b''))
+
+def jpeg(width, height, color):
+    '''Returns a JPEG of one color.
+    '''
+    data = BytesIO()
+    Image.new('RGB', (width, height), tuple(color)).save(data, format='JPEG')
+    return data.getvalue()
+
+def handler(args):
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            time.sleep(args.latency)
+            if random.random() < args.fail_rate:
+                self.send_error(500, 'fake failure')
+                return
+            color = [zlib.crc32(self.path.encode()) >> shift & 255
+                        for shift in (0, 8, 16)]
+            if self.path.endswith('.jpg') and Image is not None:
+                body = jpeg(80, 45, color)
+                content_type = 'image/jpeg'
+            else:
+                body = png(80, 45, color)
+                content_type = 'image/png'
+            if random.random() < args.garbage_rate:
+                # Not an image Pillow can read:
+                body = b'\xff\xd8 not really a jpeg'
+            self.send_response(200)
+            self.send_header('Content-Type', content_type)
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *log_args):
+            if args.verbose:
+                super().log_message(*log_args)
+    return Handler
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--port', type=int, default=8765)
+    parser.add_argument('--latency', type=float, default=0.0,
+                        help='seconds to wait before each answer')
+    parser.add_argument('--fail-rate', type=float, default=0.0,
+                        help='share of requests answered with HTTP 500')
+    parser.add_argument('--garbage-rate', type=float, default=0.0,
+                        help='share of requests answered with broken data')
+    parser.add_argument('--verbose', action='store_true')
+    args = parser.parse_args()
+    server = ThreadingHTTPServer(('127.0.0.1', args.port), handler(args))
+    print(f'Serving thumbnails on http://127.0.0.1:{args.port}',
+            file=sys.stderr)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,81 @@
+#!/usr/bin/env python
+'''Stand-in for the wtwitch script, for load tests without Twitch.
+
+Reads the follow list from $XDG_CONFIG_HOME/wtwitch/config.json and is
+configured with environment variables:
+
+    FAKE_WTWITCH_ONLINE   number of followed streamers that are live (10)
+    FAKE_WTWITCH_VODS     number of VODs per streamer (20)
+    FAKE_WTWITCH_LATENCY  seconds to sleep before answering (0)
+    FAKE_WTWITCH_FAIL     share of runs that fail, between 0 and 1 (0)
+    FAKE_WTWITCH_PLAY     seconds a fake player keeps running (1)
+    FAKE_WTWITCH_THUMBNAILS  thumbnail host, see fake_thumbnails.py
+'''
+
+import os
+import sys
+import json
+import time
+import random
+
+def setting(name, default):
+    return type(default)(os.environ.get(f'FAKE_WTWITCH_{name}', default))
+
+def check(config):
+    '''wtwitch c: writes the subscription cache and the lastSeen files.
+    '''
+    cache_dir = os.path.join(os.environ['XDG_CACHE_HOME'], 'wtwitch')
+    lastseen_dir = os.path.join(cache_dir, 'lastSeen')
+    os.makedirs(lastseen_dir, exist_ok=True)
+    logins = [diction['streamer'] for diction in config['subscriptions']]
+    thumbnail_host = setting('THUMBNAILS', 'http://127.0.0.1:1')
+    online = logins[:setting('ONLINE', 10)]
+    streams = [{'user_login': login.lower(),
+                'user_name': login,
+                'game_name': ['Chess', 'Just Chatting', 'Music'][i % 3],
+                'title': f'Fake stream {i} of {login}',
+                'viewer_count': (i * 7919) % 20000,
+                'thumbnail_url': f'{thumbnail_host}/{login}'
+                                '-{width}x{height}.png'
+                } for i, login in enumerate(online)]
+    temp_path = os.path.join(cache_dir, '.subscription-cache.json')
+    with open(temp_path, 'w') as cache:
+        json.dump({'data': streams}, cache)
+    os.replace(temp_path, os.path.join(cache_dir, 'subscription-cache.json'))
+    now = str(int(time.time()))
+    for login in online:
+        with open(os.path.join(lastseen_dir, login), 'w') as lastseen:
+            lastseen.write(now)
+
+def vods(streamer):
+    '''wtwitch v <streamer>: prints the VOD list with ANSI colors.
+    '''
+    print(f' \x1b[1m{streamer}\'s VODs:\x1b[0m', flush=True)
+    for i in range(1, setting('VODS', 20) + 1):
+        print(f' {i}. 10/{i % 28 + 1:02d} 18:{i % 60:02d}\x1b[0m '
+                f'Fake VOD {i} of {streamer} \x1b[93m{i % 9}h{i % 60:02d}m'
+                '\x1b[0m', flush=True)
+
+def main():
+    time.sleep(setting('LATENCY', 0.0))
+    if random.random() < setting('FAIL', 0.0):
+        print('wtwitch: fake failure', file=sys.stderr)
+        sys.exit(1)
+    config_path = os.path.join(os.environ['XDG_CONFIG_HOME'],
+                                'wtwitch', 'config.json')
+    with open(config_path) as config:
+        config = json.load(config)
+    args = sys.argv[1:]
+    if args[:1] == ['c']:
+        check(config)
+    elif args[:1] == ['v'] and len(args) == 2:
+        vods(args[1])
+    elif args[:1] in [['v'], ['w']]:
+        # Watching a stream or VOD: pretend to be the player for a while.
+        time.sleep(setting('PLAY', 1.0))
+    else:
+        print(f'wtwitch: unsupported arguments {args}', file=sys.stderr)
+        sys.exit(1)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,219 @@
+#!/usr/bin/env python
+'''End-to-end load test of the GUI against the fake wtwitch in
+fake_wtwitch.py, on a virtual X display.
+
+Creates a follow list of the given size, puts the fake wtwitch first on
+PATH, imports main.py (which builds the window without entering the
+mainloop) and drives it by hand. Prints render times, UI-thread block
+times and widget counts as JSON, e.g.:
+
+    python benchmarks/gui_harness.py --follows 2000 --online 300 --latency 1
+
+Needs Xvfb, unless $DISPLAY is already set.
+'''
+
+import os
+import sys
+import json
+import time
+import shutil
+import argparse
+import tempfile
+import subprocess
+
+benchmarks_dir = os.path.dirname(os.path.abspath(__file__))
+repo_dir = os.path.dirname(benchmarks_dir)
+
+def prepare_workdir(workdir, follows):
+    '''Writes a wtwitch config with the follow list, settings.json and a
+    wtwitch wrapper that runs fake_wtwitch.py.
+    '''
+    config_dir = os.path.join(workdir, 'config', 'wtwitch')
+    os.makedirs(config_dir)
+    os.makedirs(os.path.join(workdir, 'cache', 'wtwitch'))
+    config = {'player': 'mpv',
+                'quality': 'best',
+                'colors': 'true',
+                'printOfflineSubscriptions': 'true',
+                'subscriptions': [{'streamer': f'streamer_{i:05d}'}
+                                    for i in range(follows)]
+                }
+    with open(os.path.join(config_dir, 'config.json'), 'w') as config_file:
+        json.dump(config, config_file)
+    with open(os.path.join(workdir, 'settings.json'), 'w') as settings:
+        json.dump({'show_info': 'no',
+                    'show_info_preset': 'online',
+                    'window_size': '400x700',
+                    'auto_refresh': 0
+                    }, settings)
+    bin_dir = os.path.join(workdir, 'bin')
+    os.makedirs(bin_dir)
+    wrapper = os.path.join(bin_dir, 'wtwitch')
+    with open(wrapper, 'w') as script:
+        script.write(f'#!/bin/sh\nexec "{sys.executable}" '
+                    f'"{os.path.join(benchmarks_dir, "fake_wtwitch.py")}" "$@"\n')
+    os.chmod(wrapper, 0o755)
+    return bin_dir
+
+def start_xvfb():
+    '''Starts Xvfb on a free display number and returns the process.
+    '''
+    for number in range(99, 200):
+        if not os.path.exists(f'/tmp/.X11-unix/X{number}'):
+            break
+    xvfb = subprocess.Popen(['Xvfb', f':{number}', '-screen', '0',
+                            '1280x1024x24', '-nolisten', 'tcp'],
+                            stdout=subprocess.DEVNULL,
+                            stderr=subprocess.DEVNULL)
+    for _ in range(100):
+        if os.path.exists(f'/tmp/.X11-unix/X{number}'):
+            break
+        time.sleep(0.05)
+    os.environ['DISPLAY'] = f':{number}'
+    return xvfb
+
+def pump(root, condition, timeout=60):
+    '''Runs the event loop until condition() is true. Returns the wall time
+    and the longest single round of the event loop, which is how long the
+    UI thread was blocked at most.
+    '''
+    started = time.perf_counter()
+    longest = 0
+    while not condition():
+        if time.perf_counter() - started > timeout:
+            raise TimeoutError('the GUI did not finish in time')
+        round_started = time.perf_counter()
+        root.update()
+        longest = max(longest, time.perf_counter() - round_started)
+        time.sleep(0.001)
+    return time.perf_counter() - started, longest
+
+def timed_call(root, function, *args):
+    '''Times a call on the UI thread including the redraw it causes.
+    '''
+    started = time.perf_counter()
+    function(*args)
+    root.update_idletasks()
+    return time.perf_counter() - started
+
+def count_widgets(widget):
+    return 1 + sum(count_widgets(child) for child in widget.winfo_children())
+
+def run(args, workdir):
+    bin_dir = prepare_workdir(workdir, args.follows)
+    os.environ['PATH'] = bin_dir + os.pathsep + os.environ['PATH']
+    os.environ['XDG_CONFIG_HOME'] = os.path.join(workdir, 'config')
+    os.environ['XDG_CACHE_HOME'] = os.path.join(workdir, 'cache')
+    os.environ.pop('APPDATA', None)
+    os.environ.pop('LOCALAPPDATA', None)
+    os.environ['FAKE_WTWITCH_ONLINE'] = str(args.online)
+    os.environ['FAKE_WTWITCH_VODS'] = str(args.vods)
+    os.environ['FAKE_WTWITCH_LATENCY'] = str(args.latency)
+    # main.py keeps settings.json and the VOD cache in sys.path[0]:
+    sys.path[0:1] = [workdir, repo_dir]
+    sys.argv = [os.path.join(repo_dir, 'main.py')]
+    results = {'follows': args.follows,
+                'online': args.online,
+                'vods': args.vods,
+                'latency': args.latency,
+                'fail_rate': args.fail_rate
+                }
+
+    started = time.perf_counter()
+    import main as wince
+    root = wince.root
+    root.update()
+    results['startup_seconds'] = time.perf_counter() - started
+    results['startup_phases'] = dict(wince.startup_phases)
+    # The first refresh starts with the window:
+    wall, block = pump(root, lambda: wince.refresh_job is None)
+    results['initial_refresh'] = {'seconds': wall, 'max_block': block}
+    results['widgets_after_refresh'] = count_widgets(root)
+
+    # draw_main() from scratch:
+    wince.switch_list_mode(wince.virtual_list)
+    for widget in root.grid_slaves(row=0, column=0):
+        widget.destroy()
+    results['draw_main_seconds'] = timed_call(root, wince.draw_main)
+    root.update()
+
+    # Failures only apply to these refreshes. They are automatic ones, so
+    # errors show in the status bar instead of a modal dialog:
+    os.environ['FAKE_WTWITCH_FAIL'] = str(args.fail_rate)
+    timings = []
+    blocks = []
+    for _ in range(args.repeat):
+        wince.refresh_main(manual=False)
+        wall, block = pump(root, lambda: wince.refresh_job is None)
+        timings.append(wall)
+        blocks.append(block)
+    os.environ['FAKE_WTWITCH_FAIL'] = '0'
+    results['refresh_main'] = {'seconds': min(timings),
+                                'max_block': max(blocks),
+                                'failures': wince.auto_refresh['failures']}
+
+    timings = []
+    for _ in range(args.repeat):
+        timings.append(timed_call(root, wince.info_quick_toggle))
+        root.update()
+    results['info_toggle_seconds'] = min(timings)
+    results['widgets_after_info_toggle'] = count_widgets(root)
+
+    streamer = f'streamer_{args.follows - 1:05d}'
+    shutil.rmtree(os.path.join(workdir, 'vods'), ignore_errors=True)
+    wince.twitchapi.vod_memory.clear()
+    started = time.perf_counter()
+    wince.vod_panel(streamer)
+    first_rows, _ = pump(root, lambda: bool(wince.vod_panel_vods))
+    wall, block = pump(root, lambda: not wince.twitchapi.broker_jobs
+                                    and not wince.status_messages.get(
+                                        f'vods {streamer}'))
+    results['vod_panel'] = {'first_rows_seconds': first_rows,
+                            'seconds': time.perf_counter() - started,
+                            'max_block': block}
+    results['vod_panel_cached_seconds'] = timed_call(root, wince.vod_panel,
+                                                    streamer)
+    results['widgets_final'] = count_widgets(root)
+    results['command_stats'] = wince.twitchapi.command_stats()
+    root.destroy()
+    return results
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--follows', type=int, default=500)
+    parser.add_argument('--online', type=int, default=100)
+    parser.add_argument('--vods', type=int, default=20)
+    parser.add_argument('--latency', type=float, default=0.0,
+                        help='seconds the fake wtwitch waits per run')
+    parser.add_argument('--fail-rate', type=float, default=0.0,
+                        help='share of the timed refreshes that fail')
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--output', help='write the JSON here, not stdout')
+    args = parser.parse_args()
+
+    xvfb = None
+    if 'DISPLAY' not in os.environ:
+        if shutil.which('Xvfb') is None:
+            sys.exit('gui_harness.py needs Xvfb or a $DISPLAY')
+        xvfb = start_xvfb()
+    workdir = tempfile.mkdtemp(prefix='wince-harness-')
+    try:
+        results = run(args, workdir)
+    finally:
+        # Destroying the window changes the saved window size. Write the
+        # settings now, the atexit handler of twitchapi runs after workdir
+        # is gone:
+        twitchapi = sys.modules.get('twitchapi')
+        if twitchapi is not None:
+            twitchapi.save_settings()
+        shutil.rmtree(workdir, ignore_errors=True)
+        if xvfb is not None:
+            xvfb.terminate()
+    if args.output:
+        with open(args.output, 'w') as output:
+            json.dump(results, output, indent=2)
+    else:
+        print(json.dumps(results, indent=2))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,76 @@
+#!/usr/bin/env python
+
+import json
+import threading
+import http.client
+from urllib.parse import urlsplit, urlencode
+
+# The Helix streams endpoint accepts up to 100 user_login parameters:
+batch_size = 100
+timeout = 10
+
+# One kept-alive connection, reused by all requests to the same host:
+connection_state = {'key': None, 'connection': None}
+connection_lock = threading.Lock()
+
+def get_streams(logins, client_id, token, api_url='https://api.twitch.tv/helix'):
+    '''Return the stream data of all online streamers among logins. The logins
+    are sent in batches of 100 over one kept-alive connection.
+    '''
+    url = urlsplit(api_url)
+    headers = {'Client-Id': client_id,
+                'Authorization': f'Bearer {token}'
+                }
+    unique_logins = list(dict.fromkeys(login.lower() for login in logins))
+    streams = []
+    for start in range(0, len(unique_logins), batch_size):
+        batch = unique_logins[start:start + batch_size]
+        query = [('user_login', login) for login in batch]
+        query.append(('first', batch_size))
+        response = request(url, f'{url.path}/streams?{urlencode(query)}',
+                            headers)
+        streams.extend(response['data'])
+    return streams
+
+def request(url, path, headers):
+    '''Send a GET request over the kept-alive connection and return the parsed
+    JSON. A connection that the server closed is opened again once.
+    '''
+    with connection_lock:
+        for attempt in range(2):
+            connection = open_connection(url)
+            try:
+                connection.request('GET', path, headers=headers)
+                response = connection.getresponse()
+                body = response.read()
+            except (http.client.HTTPException, OSError):
+                close_connection()
+                if attempt == 1:
+                    raise
+                continue
+            if response.getheader('Connection', '').lower() == 'close':
+                close_connection()
+            if response.status != 200:
+                raise RuntimeError(f'Twitch API error {response.status}: '
+                                    f'{body.decode(errors="replace")}')
+            return json.loads(body)
+
+def open_connection(url):
+    key = url.scheme, url.hostname, url.port
+    if connection_state['key'] != key:
+        close_connection()
+        if url.scheme == 'https':
+            connection = http.client.HTTPSConnection(url.hostname, url.port,
+                                                    timeout=timeout)
+        else:
+            connection = http.client.HTTPConnection(url.hostname, url.port,
+                                                    timeout=timeout)
+        connection_state['connection'] = connection
+        connection_state['key'] = key
+    return connection_state['connection']
+
+def close_connection():
+    if connection_state['connection'] is not None:
+        connection_state['connection'].close()
+    connection_state['connection'] = None
+    connection_state['key'] = None
@@ -0,0 +1,185 @@
+#!/usr/bin/env python
+
+import os
+import sys
+import mmap
+import time
+import struct
+import threading
+from collections import deque
+
+# One record per online streamer and refresh: login id, timestamp, viewer
+# count and category id, as little endian unsigned ints. Ids point into the
+# interned string table.
+record_format = struct.Struct('<IIII')
+# A new segment is started when the current one holds this many records.
+# Segments beyond max_segments or older than retention_days are deleted:
+segment_records = 65536
+max_segments = 16
+retention_days = 90
+# Viewer counts per streamer for the sparkline:
+sparkline_points = 24
+sparkline_bars = '▁▂▃▄▅▆▇█'
+
+# The interned strings, and per-login aggregates of all segments. Segments
+# are only read from the offset scanned last time:
+strings = {'ids': {}, 'names': [], 'loaded': False}
+summaries = {}
+scanned = {}
+history_lock = threading.Lock()
+
+def history_dir():
+    return f'{sys.path[0]}/history'
+
+def strings_file():
+    return f'{history_dir()}/strings.txt'
+
+def segment_files():
+    '''Return the paths of the segments, oldest first.
+    '''
+    try:
+        names = sorted(name for name in os.listdir(history_dir())
+                        if name.startswith('segment-') and name.endswith('.bin'))
+    except FileNotFoundError:
+        return []
+    return [f'{history_dir()}/{name}' for name in names]
+
+def load_strings():
+    if strings['loaded']:
+        return
+    try:
+        with open(strings_file(), encoding='utf-8') as table:
+            for name in table.read().split('\n')[:-1]:
+                strings['ids'][name] = len(strings['names'])
+                strings['names'].append(name)
+    except FileNotFoundError:
+        pass
+    strings['loaded'] = True
+
+def intern(name):
+    '''Return the id of a string. New strings are added in memory, record()
+    appends them to the string table file.
+    '''
+    name = name.replace('\n', ' ')
+    string_id = strings['ids'].get(name)
+    if string_id is None:
+        string_id = len(strings['names'])
+        strings['ids'][name] = string_id
+        strings['names'].append(name)
+    return string_id
+
+def record(streamers, timestamp=None):
+    '''Append one record per online Streamer to the current segment, then
+    apply retention and bring the summaries up to date.
+    '''
+    if timestamp is None:
+        timestamp = int(time.time())
+    with history_lock:
+        os.makedirs(history_dir(), exist_ok=True)
+        load_strings()
+        known = len(strings['names'])
+        data = b''.join(record_format.pack(intern(package.login.lower()),
+                                            timestamp,
+                                            package.viewers,
+                                            intern(package.category))
+                        for package in streamers)
+        # The strings are written first, so every id in a segment resolves:
+        if len(strings['names']) > known:
+            with open(strings_file(), 'a', encoding='utf-8') as table:
+                table.write(''.join(f'{name}\n'
+                                    for name in strings['names'][known:]))
+        segments = segment_files()
+        if (not segments or os.path.getsize(segments[-1])
+                            >= segment_records * record_format.size):
+            segments.append(f'{history_dir()}/segment-{timestamp:010d}.bin')
+        with open(segments[-1], 'ab') as segment:
+            segment.write(data)
+        if expire(segments, timestamp):
+            summaries.clear()
+            scanned.clear()
+        scan()
+
+def expire(segments, now):
+    '''Delete the oldest segments beyond max_segments and the ones that were
+    last written before the retention period. Returns whether any were
+    deleted.
+    '''
+    expired = segments[:-max_segments]
+    for path in segments[-max_segments:-1]:
+        if os.path.getmtime(path) < now - retention_days * 86400:
+            expired.append(path)
+    for path in expired:
+        os.remove(path)
+    return bool(expired)
+
+def scan():
+    '''Read the records that were added since the last scan. The segments
+    are memory mapped, so only the summaries stay in memory.
+    '''
+    for path in segment_files():
+        size = os.path.getsize(path)
+        start = scanned.get(path, 0)
+        end = start + (size - start) // record_format.size * record_format.size
+        if end <= start:
+            continue
+        with open(path, 'rb') as segment:
+            with mmap.mmap(segment.fileno(), 0, access=mmap.ACCESS_READ) as data:
+                view = memoryview(data)[start:end]
+                try:
+                    add_records(record_format.iter_unpack(view))
+                finally:
+                    view.release()
+        scanned[path] = end
+
+def add_records(records):
+    for login_id, timestamp, viewers, category_id in records:
+        stats = summaries.get(login_id)
+        if stats is None:
+            stats = {'viewers': deque(maxlen=sparkline_points),
+                    'hours': [0] * 24}
+            summaries[login_id] = stats
+        stats['viewers'].append(viewers)
+        stats['hours'][time.localtime(timestamp).tm_hour] += 1
+
+def load():
+    '''Read the string table and all segments once, so the summaries are
+    there before the first record(). Takes a while for a long history, so
+    it has to run off the Tk thread.
+    '''
+    with history_lock:
+        load_strings()
+        scan()
+
+def summary(login):
+    '''Return the recent viewer counts and the records per local hour of a
+    streamer, or None without history. Doesn't wait for history_lock, so a
+    running scan never blocks the Tk thread. The copies are single C calls,
+    which the GIL keeps atomic.
+    '''
+    string_id = strings['ids'].get(login.lower())
+    stats = summaries.get(string_id)
+    if stats is None:
+        return None
+    return list(stats['viewers'].copy()), stats['hours'].copy()
+
+def sparkline(values):
+    if len(values) < 2:
+        return None
+    highest = max(values) or 1
+    return ''.join(sparkline_bars[value * (len(sparkline_bars) - 1) // highest]
+                    for value in values)
+
+def usually_live(hours):
+    '''Return the hours around the most common hour, in which the streamer
+    was live at least half as often, as (first hour, last hour).
+    '''
+    highest = max(hours)
+    if not highest:
+        return None
+    peak = hours.index(highest)
+    first = last = peak
+    while (first - 1) % 24 != last and hours[(first - 1) % 24] * 2 >= highest:
+        first = (first - 1) % 24
+    while (last + 1) % 24 != first and hours[(last + 1) % 24] * 2 >= highest:
+        last = (last + 1) % 24
+    return first, last
@@ -1,214 +1,802 @@
 #!/usr/bin/env python
 
+import bisect
+import random
+import sys
+import time
+from collections import OrderedDict
 import tkinter as tk
 from tkinter import ttk
 from tkinter import messagebox
 from tkinter import simpledialog
+from tkinter import filedialog
 import twitchapi
+import tracing
+import history
+import thumbnails
 
+startup_started = time.perf_counter()
+
+@tracing.traced('vod_panel')
 def vod_panel(streamer):
-    '''Draw 2 columns for the watch buttons and timestamps/stream length of
-    the last 20 VODs.
+    '''Shows the streamer's cached VODs right away. Missing or stale VODs are
+    fetched in the background. Without cached VODs, they are shown while
+    wtwitch v prints them.
+    '''
+    global vod_panel_requested
+    vod_panel_requested = streamer
+    vods, stale = twitchapi.cached_vods(streamer)
+    if vods:
+        draw_vod_panel(streamer, vods)
+    elif vods is not None and not stale:
+        no_vods_dialog(streamer)
+    if stale:
+        job = twitchapi.refresh_vods_async(streamer)
+        show_status(f'vods {streamer}', f'Loading VODs of {streamer}…')
+        root.after(100, poll_vods, streamer, job, vods)
+
+def poll_vods(streamer, job, cached):
+    '''Checks every 100 ms if the VOD refresh is done and updates the panel,
+    if the streamer's VODs are still the last requested ones.
     '''
-    # Retrieve the streamer's VODs:
-    vods = twitchapi.fetch_vods(streamer)
+    if not job.done():
+        partial = twitchapi.partial_vods(streamer)
+        if not cached and partial and vod_panel_requested == streamer:
+            if vod_panel_streamer != streamer:
+                draw_vod_panel(streamer, [])
+            add_vod_rows(partial[len(vod_panel_vods):])
+        root.after(100, poll_vods, streamer, job, cached)
+        return
+    hide_status(f'vods {streamer}')
+    try:
+        vods = job.result()
+    except Exception as e:
+        if vod_panel_requested == streamer and not cached:
+            error_dialog(e)
+        return
+    if vod_panel_requested != streamer:
+        return
+    # The refresh only updates streamers that are already in memory:
+    twitchapi.cached_vods(streamer, touch=False)
     # Account for streamer having zero VODs:
-    if len(vods[0]) == 0:
-        no_vods = messagebox.showinfo(title=f"No VODs",
-                        message=f"{streamer} has no VODs",
-                        parent=root
-                        )
+    if len(vods) == 0:
+        close_vod_panel()
+        no_vods_dialog(streamer)
+    elif vod_panel_streamer != streamer or vods != vod_panel_vods:
+        draw_vod_panel(streamer, vods)
+
+def no_vods_dialog(streamer):
+    messagebox.showinfo(title=f"No VODs",
+                    message=f"{streamer} has no VODs",
+                    parent=root
+                    )
+
+def schedule_prefetch():
+    '''Warms the VOD cache every vod_prefetch_interval minutes, for all or
+    only the offline streamers, depending on the vod_prefetch setting.
+    '''
+    start_prefetch()
+    interval = twitchapi.get_setting('vod_prefetch_interval', 30)
+    root.after(int(interval * 60000), schedule_prefetch)
+
+def start_prefetch():
+    global prefetch_jobs
+    mode = twitchapi.get_setting('vod_prefetch', 'off')
+    if mode == 'off' or prefetch_jobs:
+        return
+    streamers = [package.login for package in streamer_status[1]]
+    if mode == 'all':
+        streamers += [package.login for package in streamer_status[0]]
+    prefetch_jobs = twitchapi.prefetch_vods(streamers)
+    poll_prefetch()
+
+def poll_prefetch():
+    '''Shows the progress of the VOD prefetch and the number of failed
+    streamers, once it is done.
+    '''
+    global prefetch_jobs
+    done = [job for job in prefetch_jobs.values() if job.done()]
+    if len(done) < len(prefetch_jobs):
+        show_status('prefetch', f'Prefetching VODs: '
+                                f'{len(done)}/{len(prefetch_jobs)}')
+        root.after(500, poll_prefetch)
         return
+    hide_status('prefetch')
+    failed = [streamer for streamer, job in prefetch_jobs.items()
+                if job.exception() is not None]
+    prefetch_jobs = {}
+    if failed:
+        show_status('prefetch failed', f'VOD prefetch failed for '
+                                        f'{len(failed)} streamer(s)')
+        root.after(10000, hide_status, 'prefetch failed')
+
+def change_prefetch(value):
+    twitchapi.change_settings_file('vod_prefetch', value)
+    start_prefetch()
+
+def close_vod_panel():
+    global vod_panel_streamer
+    global vod_panel_requested
+    if vod_panel_frame is not None:
+        vod_panel_frame.grid_remove()
+    vod_panel_streamer = None
+    vod_panel_requested = None
+    vod_panel_vods.clear()
+
+def build_vod_panel():
+    '''Creates the VOD panel once. It's hidden when closed and reused for the
+    next streamer.
+    '''
+    global vod_panel_frame
+    global vod_canvas
+    global vod_scrollbar
+    global vod_frame
     # frame-canvas-frame to attach a scrollbar:
     close_button = tk.Button(
                         root,
-                        image=close_icon,
+                        image=icon('close_icon'),
                         relief='flat',
-                        command=lambda: [vw_frame.forget(), vw_frame.destroy()]
+                        command=close_vod_panel
                         )
-    vw_frame = ttk.Labelframe(root, labelwidget=close_button)
-    vw_frame.grid(column=0, row=1, sticky='nsew')
-    vw_frame.columnconfigure(0, weight=1)
-    vw_frame.rowconfigure(0, weight=1)
-    met_frame = ttk.Frame(vw_frame)
+    vod_panel_frame = ttk.Labelframe(root, labelwidget=close_button)
+    vod_panel_frame.columnconfigure(0, weight=1)
+    vod_panel_frame.rowconfigure(0, weight=1)
+    met_frame = ttk.Frame(vod_panel_frame)
     met_frame.grid(column=0, row=1, sticky='nsew')
     met_frame.columnconfigure(0, weight=1)
     met_frame.rowconfigure(0, weight=1)
-    vw_canvas = tk.Canvas(met_frame)
-    vw_scrollbar = ttk.Scrollbar(met_frame,orient="vertical",
-                        command=vw_canvas.yview
-                        )
-    vw_canvas.configure(yscrollcommand=vw_scrollbar.set)
-    vod_frame = ttk.Labelframe(met_frame,
-                        text=f"{streamer}'s VODs",
+    vod_canvas = tk.Canvas(met_frame)
+    vod_scrollbar = ttk.Scrollbar(met_frame,orient="vertical",
+                        command=vod_canvas.yview
                         )
+    vod_canvas.configure(yscrollcommand=vod_scrolled)
+    vod_frame = ttk.Labelframe(met_frame)
     vod_frame.bind("<Configure>", lambda e:
-                        vw_canvas.configure(
-                        scrollregion=vw_canvas.bbox("all"))
-                        )
-    # Draw the VOD grid:
-    vod_number = 1
-    for timestamp, title, length in zip(vods[0], vods[1], vods[2]):
-        watch_button = tk.Button(vod_frame,
-                        image=play_icon,
-                        relief='flat',
-                        height='24', width='24',
-                        command=lambda s=streamer, v=vod_number:
-                        [twitchapi.start_vod(s, v)]
+                        vod_canvas.configure(
+                        scrollregion=vod_canvas.bbox("all"))
                         )
-        watch_button.grid(column=0, row=vod_number, sticky='nesw')
-        timestamp_button = tk.Button(vod_frame, text=f"{timestamp} ({length})",
-                        command=lambda ts=timestamp, t=title, p=root:
-                        messagebox.showinfo("VOD", ts, detail=t, parent=p),
-                        font=small_font,
-                        relief='flat',
-                        anchor='w'
-                        )
-        timestamp_button.grid(column=1, row=vod_number, sticky='nesw')
-        vod_number += 1
     # Finish the scrollbar
-    vw_canvas.create_window((0, 0), window=vod_frame, anchor="nw")
-    vw_canvas.grid(row=0, column=0, sticky="nsew", padx=8, pady=5)
-    vw_scrollbar.grid(row=0, column=1, sticky="ns")
-    vw_canvas.bind_all("<MouseWheel>", mouse_scroll)
+    vod_canvas.create_window((0, 0), window=vod_frame, anchor="nw")
+    vod_canvas.grid(row=0, column=0, sticky="nsew", padx=8, pady=5)
+    vod_scrollbar.grid(row=0, column=1, sticky="ns")
+    bind_wheel(vod_canvas, vod_canvas)
+    bind_wheel(vod_frame, vod_canvas)
 
-def streamer_buttons():
-    online_streamers = streamer_status[0]
-    offline_streamers = streamer_status[1]
-    count_rows = 0
-    for package in online_streamers:
-        show_info_status[count_rows] = False
-        watch_button = tk.Button(main_frame,
-                        image=streaming_icon,
-                        relief='flat',
-                        command=lambda s=package[0]:
-                        [twitchapi.start_stream(s)]
-                        )
-        watch_button.grid(column=0, row=count_rows, sticky='nsew', ipadx=4)
-        if current_info_setting == 'all' or current_info_setting == 'online':
-            watch_button.grid_configure(rowspan=2)
-            info_button = tk.Button(main_frame,
-                            text=package[1],
-                            anchor='w',
-                            font=cantarell_13_bold,
+def draw_vod_panel(streamer, vods):
+    '''Shows the panel with 2 columns for the watch buttons and
+    timestamps/stream length of the streamer's VODs. Only the first page of
+    rows is drawn, the rest follows while scrolling.
+    '''
+    global vod_panel_streamer
+    global vod_panel_requested
+    global vod_rows_shown
+    if vod_panel_frame is None:
+        build_vod_panel()
+    vod_panel_streamer = streamer
+    vod_panel_requested = streamer
+    vod_panel_vods[:] = vods
+    vod_rows_shown = 0
+    vod_frame.configure(text=f"{streamer}'s VODs")
+    show_vod_rows(vod_page_size)
+    vod_canvas.yview_moveto(0)
+    vod_panel_frame.grid(column=0, row=1, sticky='nsew')
+
+def add_vod_rows(vods):
+    '''Adds VODs to the open panel. They are drawn right away, if the current
+    page isn't full yet.
+    '''
+    vod_panel_vods.extend(vods)
+    show_vod_rows(vod_page_size - vod_rows_shown)
+
+def show_vod_rows(count):
+    '''Binds the next rows of the panel to VODs, creating row widgets only if
+    no earlier streamer needed this many, and hides the rest.
+    '''
+    global vod_rows_shown
+    streamer = vod_panel_streamer
+    end = min(vod_rows_shown + max(count, 0), len(vod_panel_vods))
+    for position in range(vod_rows_shown, end):
+        vod = vod_panel_vods[position]
+        if position == len(vod_rows):
+            watch_button = tk.Button(vod_frame,
+                            image=icon('play_icon'),
                             relief='flat',
-                            state='disabled',
-                            disabledforeground='#000000'
+                            height='24', width='24'
                             )
-            online_info(count_rows, package[1], package[2],
-                        package[3], package[4]
-                        )
-        else:
-            info_button = tk.Button(main_frame,
-                            text=package[1],
-                            anchor='w',
-                            font=cantarell_13_bold,
+            timestamp_button = tk.Button(vod_frame,
+                            font=small_font,
                             relief='flat',
-                            command=lambda c=count_rows, s=package[1],
-                                        cat=package[2], t=package[3],
-                                        v=package[4]:
-                                        online_info(c, s, cat, t, v)
+                            anchor='w'
                             )
-        info_button.grid(column=1, row=count_rows, sticky='nsew')
-        unfollow_b = tk.Button(main_frame,
-                        image=unfollow_icon,
-                        relief='flat',
-                        command=lambda s=package[0]:
-                        [unfollow_dialog(s)]
+            bind_wheel(watch_button, vod_canvas)
+            bind_wheel(timestamp_button, vod_canvas)
+            vod_rows.append((watch_button, timestamp_button))
+        watch_button, timestamp_button = vod_rows[position]
+        watch_button.configure(command=lambda s=streamer, v=vod.index:
+                        [watch_vod(s, v)]
                         )
-        unfollow_b.grid(column=2, row=count_rows, sticky='nsew', ipadx=4)
-        vod_b = tk.Button(main_frame,
-                        image=vod_icon,
-                        relief='flat',
-                        command=lambda s=package[0]:
-                        vod_panel(s)
+        watch_button.grid(column=0, row=position, sticky='nesw')
+        timestamp_button.configure(text=f"{vod.timestamp} ({vod.length})",
+                        command=lambda ts=vod.timestamp, t=vod.title, p=root:
+                        messagebox.showinfo("VOD", ts, detail=t, parent=p)
                         )
-        vod_b.grid(column=3, row=count_rows, sticky='nsew', ipadx=8)
-        ttk.Separator(main_frame).grid(row=count_rows+2,
-                                        columnspan=5,
-                                        sticky='ew'
-                                        )
-        count_rows += 3
-    for streamer in offline_streamers:
-        show_info_status[count_rows] = False
-        watch_button = tk.Label(main_frame,
-                        image=offline_icon,
-                        relief='flat'
-                        )
-        watch_button.grid(column=0, row=count_rows, sticky='nsew', ipadx=4)
-        if current_info_setting == 'all':
-            watch_button.grid_configure(rowspan=2)
-            info_button = tk.Button(main_frame,
-                            text=streamer,
-                            anchor='w',
-                            font=cantarell_13_bold,
-                            relief='flat',
-                            state='disabled',
-                            disabledforeground='#474747'
-                            )
-            offline_info(count_rows, streamer)
+        timestamp_button.grid(column=1, row=position, sticky='nesw')
+    vod_rows_shown = end
+    for watch_button, timestamp_button in vod_rows[end:]:
+        watch_button.grid_remove()
+        timestamp_button.grid_remove()
+
+def vod_scrolled(first, last):
+    '''yscrollcommand of the VOD canvas. Draws the next page of rows when the
+    end of the drawn rows comes into view.
+    '''
+    vod_scrollbar.set(first, last)
+    if float(last) > 0.9 and vod_rows_shown < len(vod_panel_vods):
+        root.after_idle(show_vod_rows, vod_page_size)
+
+@tracing.traced('streamer_buttons')
+def streamer_buttons():
+    '''Reconciles the rows in main_frame with streamer_status. Every followed
+    streamer keeps one row, which is only reconfigured if its status changed.
+    Long follow lists switch to a virtual list, which only has rows for the
+    visible part of the canvas.
+    '''
+    streamer_packages.clear()
+    for package in streamer_status[0] + streamer_status[1]:
+        streamer_packages[package.login] = package
+    virtual = use_virtual_list(len(streamer_packages))
+    if virtual != virtual_list:
+        switch_list_mode(virtual)
+    if not virtual:
+        # Drop the rows of unfollowed streamers:
+        for login in list(streamer_rows):
+            if login not in streamer_packages:
+                streamer_rows.pop(login)['frame'].destroy()
+        for login, package in streamer_packages.items():
+            row = streamer_rows.get(login)
+            if row is None:
+                row = create_row()
+                streamer_rows[login] = row
+            if not row_is_current(row, login, package):
+                update_row(row, login, package)
+    layout_rows(list_order())
+
+def list_order():
+    '''Returns the keys of the rows to show: the sorted logins that match
+    the filter, with a header before each group if they are grouped by
+    category.
+    '''
+    order = filter_order(sorted_order())
+    if twitchapi.get_setting('group_by_category', 'no') == 'yes':
+        order = grouped_order(order)
+    return order
+
+def sorted_order():
+    '''Returns all logins in the order of the sort_mode setting. Each sort
+    mode is computed once per status update.
+    '''
+    mode = twitchapi.get_setting('sort_mode', 'name')
+    if sort_state['status'] is not streamer_status:
+        sort_state['status'] = streamer_status
+        sort_state['orders'] = {}
+    if mode not in sort_state['orders']:
+        sort_state['orders'][mode] = twitchapi.sort_streamers(streamer_status,
+                                                                mode)
+    return sort_state['orders'][mode]
+
+def grouped_order(order):
+    '''Groups the online streamers by category, in alphabetical order, and
+    puts the offline streamers in a last group. Every group starts with the
+    key of its header row.
+    '''
+    groups = {}
+    offline = []
+    for login in order:
+        package = streamer_packages[login]
+        if package.online:
+            groups.setdefault(package.category, []).append(login)
         else:
-            info_button = tk.Button(main_frame,
-                            text=streamer,
-                            anchor='w',
-                            font=cantarell_13_bold,
-                            fg='#474747',
-                            relief='flat',
-                            compound='left',
-                            command= lambda s=streamer, c=count_rows:
-                                    offline_info(c, s)
-                            )
-        info_button.grid(column=1, row=count_rows, sticky='nsew')
-        unfollow_b = tk.Button(main_frame,
-                        image=unfollow_icon,
-                        relief='flat',
-                        command=lambda s=streamer:
-                        [unfollow_dialog(s)]
-                        )
-        unfollow_b.grid(column=2, row=count_rows, sticky='nsew', ipadx=4)
-        vod_b = tk.Button(main_frame,
-                        image=vod_icon,
-                        relief='flat',
-                        command=lambda s=streamer:
-                        vod_panel(s)
-                        )
-        vod_b.grid(column=3, row=count_rows, sticky='nsew', ipadx=8)
-        if count_rows != (len(online_streamers)+len(offline_streamers))*3-3:
-            ttk.Separator(main_frame).grid(row=count_rows+2,
-                                            columnspan=5,
-                                            sticky='ew'
-                                            )
-        count_rows += 3
-
-def online_info(c, streamer, category, title, viewercount):
-    if not show_info_status[c]:
-        info_content[c] = tk.Label(main_frame,
-                                    text=f'Title: {title}\n'
-                                    f'Category: {category}\n'
-                                    f'Viewer count: {viewercount}',
-                                    justify='left',
-                                    anchor='w'
-                                    )
-        info_content[c].grid(row=c+1, column=1, columnspan=4, sticky='w', padx=10)
-        show_info_status[c] = True
+            offline.append(login)
+    grouped = []
+    for category in sorted(groups, key=str.lower):
+        key = ('category', category)
+        header_texts[key] = f'{category or "No category"} ' \
+                            f'({len(groups[category])})'
+        grouped.append(key)
+        grouped.extend(groups[category])
+    if offline:
+        key = ('offline',)
+        header_texts[key] = f'Offline ({len(offline)})'
+        grouped.append(key)
+        grouped.extend(offline)
+    return grouped
+
+def filter_order(order):
+    '''Returns the logins in order that match the filter entry. The first
+    search after a status update starts building the search index in the
+    background. Until it is ready, the text of every streamer is compared.
+    '''
+    query = filter_text.get().strip().lower()
+    if not query:
+        return order
+    if search_state['status'] is not streamer_status:
+        search_state['status'] = streamer_status
+        search_state['index'] = twitchapi.search_index_async(
+                                            list(streamer_packages.values()))
+    if search_state['index'].done():
+        matches = twitchapi.search_streamers(search_state['index'].result(),
+                                            query)
+        return [login for login in order if login in matches]
+    return [login for login in order if twitchapi.text_matches(
+                    twitchapi.search_text(streamer_packages[login]), query)]
+
+def filter_changed(*args):
+    '''Shows only the matching rows. The rows are kept, so filtering never
+    runs streamer_buttons() again.
+    '''
+    layout_rows(list_order())
+    meta_canvas.yview_moveto(0)
+
+def change_sort(setting, value):
+    '''Reorders the existing rows after a change of the sort_mode or
+    group_by_category setting.
+    '''
+    twitchapi.change_settings_file(setting, value)
+    layout_rows(list_order())
+
+def use_virtual_list(follows):
+    setting = twitchapi.get_setting('virtual_list', 'auto')
+    if setting == 'auto':
+        return follows > virtual_list_threshold
+    return setting == 'yes'
+
+def switch_list_mode(virtual):
+    '''Throws away all rows, so the list can be rebuilt in the other mode.
+    '''
+    global virtual_list
+    for row in list(streamer_rows.values()) + list(header_rows.values()):
+        row['frame'].destroy()
+    streamer_rows.clear()
+    header_rows.clear()
+    for row in list(visible_rows.values()) + spare_rows:
+        row['frame'].destroy()
+    visible_rows.clear()
+    spare_rows.clear()
+    row_heights.clear()
+    main_frame.configure(height=0)
+    virtual_list = virtual
+
+def create_row():
+    '''Creates the widgets of a row. They get their content from update_row()
+    and read the streamer's name from the row, so rows can be recycled.
+    '''
+    frame = ttk.Frame(main_frame)
+    frame.columnconfigure(1, weight=1)
+    row = {'frame': frame,
+            'login': None,
+            'package': None,
+            'info_setting': None,
+            'expanded': False,
+            'playing': False,
+            'position': None,
+            'last': None,
+            'history': None
+            }
+    row['watch'] = tk.Button(frame,
+                    image=icon('streaming_icon'),
+                    relief='flat',
+                    command=lambda r=row:
+                    [watch_stream(r['login'])]
+                    )
+    row['offline'] = tk.Label(frame,
+                    image=icon('offline_icon'),
+                    relief='flat'
+                    )
+    row['name'] = tk.Button(frame,
+                    anchor='w',
+                    font=cantarell_13_bold,
+                    relief='flat',
+                    command=lambda r=row: toggle_info(r['login'])
+                    )
+    row['name'].grid(column=1, row=0, sticky='nsew')
+    row['unfollow'] = tk.Button(frame,
+                    image=icon('unfollow_icon'),
+                    relief='flat',
+                    command=lambda r=row:
+                    [unfollow_dialog(r['login'])]
+                    )
+    row['unfollow'].grid(column=2, row=0, sticky='nsew', ipadx=4)
+    row['vod'] = tk.Button(frame,
+                    image=icon('vod_icon'),
+                    relief='flat',
+                    command=lambda r=row:
+                    vod_panel(r['login'])
+                    )
+    row['vod'].grid(column=3, row=0, sticky='nsew', ipadx=8)
+    row['info'] = tk.Label(frame, justify='left', anchor='w')
+    row['separator'] = ttk.Separator(frame)
+    for widget in [frame] + frame.winfo_children():
+        bind_wheel(widget, meta_canvas)
+    return row
+
+def info_preset_applies(package):
+    if package.online:
+        return current_info_setting in ['all', 'online']
+    return current_info_setting == 'all'
+
+def is_expanded(login, package):
+    return info_preset_applies(package) or login in expanded_streamers
+
+def row_is_current(row, login, package):
+    return (row['login'] == login
+            and row['package'] == package
+            and row['info_setting'] == current_info_setting
+            and row['expanded'] == is_expanded(login, package)
+            and row['playing'] == (login in twitchapi.playing_streams())
+            and (not row['expanded'] or row['history'] == history_info(login))
+            )
+
+def update_row(row, login, package, expanded=None):
+    '''Shows the streamer's online/offline status in the row.
+    '''
+    if package.online:
+        row['offline'].grid_remove()
+        row['watch'].grid(column=0, row=0, rowspan=2, sticky='nsew', ipadx=4)
+        show_thumbnail(row, login)
+        row['name'].configure(text=package.name, fg='#000000',
+                                disabledforeground='#000000')
+        row['info'].configure(fg='#000000')
     else:
-        info_content[c].grid_remove()
-        show_info_status[c] = False
-
-def offline_info(c, streamer):
-    if not show_info_status[c]:
-        info_content[c] = tk.Label(main_frame,
-                                    text=f'Last seen: '
-                                    f'{twitchapi.last_seen(streamer)}',
-                                    justify='left',
-                                    anchor='w',
-                                    fg='#474747'
-                                    )
-        info_content[c].grid(row=c+1, column=1, columnspan=4, sticky='w')
-        show_info_status[c] = True
+        row['watch'].grid_remove()
+        row['offline'].grid(column=0, row=0, rowspan=2, sticky='nsew', ipadx=4)
+        row['name'].configure(text=package.name, fg='#474747',
+                                disabledforeground='#474747')
+        row['info'].configure(fg='#474747')
+    # The expand info preset shows the info and disables the toggle:
+    if info_preset_applies(package):
+        row['name'].configure(state='disabled')
     else:
-        info_content[c].grid_remove()
-        show_info_status[c] = False
+        row['name'].configure(state='normal')
+    # Sink the watch button while the stream is playing:
+    playing = login in twitchapi.playing_streams()
+    if playing:
+        row['watch'].configure(relief='sunken')
+    else:
+        row['watch'].configure(relief='flat')
+    if expanded is None:
+        expanded = is_expanded(login, package)
+    row['playing'] = playing
+    row['login'] = login
+    row['package'] = package
+    row['info_setting'] = current_info_setting
+    row['expanded'] = expanded
+    draw_info(row)
+
+def layout_rows(order):
+    '''Puts the rows in the given order. Rows that kept their position and
+    separator are left alone.
+    '''
+    global row_order
+    row_order = order
+    schedule_thumbnails()
+    if virtual_list:
+        layout_virtual_rows()
+        return
+    # Hide the rows that the filter or grouping left out:
+    shown = set(order)
+    for key, row in list(streamer_rows.items()) + list(header_rows.items()):
+        if key not in shown and row['position'] is not None:
+            row['frame'].grid_remove()
+            row['position'] = None
+    for position, key in enumerate(order):
+        row = header_row(key) if is_header(key) else streamer_rows[key]
+        if row['position'] != position:
+            row['frame'].grid(row=position, column=0, sticky='nsew')
+            row['position'] = position
+        if not is_header(key):
+            show_separator(row, position != len(order) - 1)
+
+def is_header(key):
+    '''Group headers are keyed by tuples, streamer rows by login.
+    '''
+    return isinstance(key, tuple)
+
+def header_row(key):
+    '''Returns the header row of a group, with the text from header_texts.
+    '''
+    row = header_rows.get(key)
+    if row is None:
+        frame = ttk.Frame(main_frame)
+        label = ttk.Label(frame, font=cantarell_12_bold)
+        label.grid(row=0, column=0, sticky='w', padx=5, pady=(6, 2))
+        bind_wheel(frame, meta_canvas)
+        bind_wheel(label, meta_canvas)
+        row = {'frame': frame, 'label': label, 'text': None, 'position': None}
+        header_rows[key] = row
+    if row['text'] != header_texts[key]:
+        row['label'].configure(text=header_texts[key])
+        row['text'] = header_texts[key]
+    return row
+
+def show_separator(row, visible):
+    if row['last'] == (not visible):
+        return
+    if visible:
+        row['separator'].grid(row=2, columnspan=4, sticky='ew')
+    else:
+        row['separator'].grid_remove()
+    row['last'] = not visible
+
+def row_height(online, expanded):
+    '''Measures the height of a row type once, using a row that is never
+    shown.
+    '''
+    kind = (online, expanded)
+    if kind not in row_heights:
+        row = create_row()
+        package = twitchapi.Streamer('', '', '', '', 0, online)
+        update_row(row, '', package, expanded)
+        show_separator(row, True)
+        row['frame'].update_idletasks()
+        row_heights[kind] = row['frame'].winfo_reqheight()
+        row['frame'].destroy()
+    return row_heights[kind]
+
+def header_height():
+    '''Measures the height of a group header once, like row_height().
+    '''
+    if 'header' not in row_heights:
+        header_texts[('measure',)] = ''
+        row = header_row(('measure',))
+        row['frame'].update_idletasks()
+        row_heights['header'] = row['frame'].winfo_reqheight()
+        header_rows.pop(('measure',))['frame'].destroy()
+        header_texts.pop(('measure',))
+    return row_heights['header']
+
+def layout_virtual_rows():
+    '''Computes the y offset of every row in the virtual list and sizes
+    main_frame to the full list height. Only visible rows get widgets.
+    '''
+    global row_offsets
+    row_offsets = []
+    y = 0
+    for login in row_order:
+        row_offsets.append(y)
+        if is_header(login):
+            y += header_height()
+            continue
+        package = streamer_packages[login]
+        y += row_height(package.online, is_expanded(login, package))
+    main_frame.configure(height=max(y, 1))
+    # Visible rows are placed again, in case their offset changed:
+    spare_rows.extend(visible_rows.values())
+    visible_rows.clear()
+    render_visible_rows()
+
+def render_visible_rows():
+    '''Binds recycled rows to the streamers in the visible part of the canvas
+    plus a few rows of overscan.
+    '''
+    global render_pending
+    render_pending = False
+    if not virtual_list:
+        return
+    top = meta_canvas.canvasy(0)
+    bottom = top + meta_canvas.winfo_height()
+    first = max(bisect.bisect_right(row_offsets, top) - 1 - overscan_rows, 0)
+    last = min(bisect.bisect_left(row_offsets, bottom) + overscan_rows,
+                len(row_order))
+    for position in list(visible_rows):
+        if not first <= position < last:
+            spare_rows.append(visible_rows.pop(position))
+    for position in range(first, last):
+        if is_header(row_order[position]):
+            continue
+        row = visible_rows.get(position)
+        if row is None:
+            row = spare_rows.pop() if spare_rows else create_row()
+            visible_rows[position] = row
+            row['frame'].place(x=0, y=row_offsets[position], relwidth=1)
+            row['position'] = position
+        login = row_order[position]
+        package = streamer_packages[login]
+        if not row_is_current(row, login, package):
+            update_row(row, login, package)
+        show_separator(row, position != len(row_order) - 1)
+    for row in spare_rows:
+        if row['position'] is not None:
+            row['frame'].place_forget()
+            row['position'] = None
+    # Group headers have one row each, placed while they are in view:
+    headers = {row_order[position]: position for position in range(first, last)
+                if is_header(row_order[position])}
+    for key, row in list(header_rows.items()):
+        if key not in headers and row['position'] is not None:
+            row['frame'].place_forget()
+            row['position'] = None
+    for key, position in headers.items():
+        row = header_row(key)
+        row['frame'].place(x=0, y=row_offsets[position], relwidth=1)
+        row['position'] = position
+
+def schedule_render(first, last):
+    '''yscrollcommand of the main canvas. Renders the virtual list once the
+    scrolling settles for this round of the event loop.
+    '''
+    global render_pending
+    main_scrollbar.set(first, last)
+    if virtual_list and not render_pending:
+        render_pending = True
+        root.after_idle(render_visible_rows)
+    schedule_thumbnails()
+
+def thumbnails_enabled():
+    '''Twitch thumbnails are JPEGs, so they need Pillow.
+    '''
+    return (thumbnails.Image is not None
+            and twitchapi.get_setting('thumbnails', 'off') == 'on')
+
+def show_thumbnail(row, login):
+    '''Shows the stream's thumbnail on the watch button, or the streaming
+    icon until it is loaded. The button keeps the thumbnail size either way,
+    so the row height doesn't change.
+    '''
+    if not thumbnails_enabled():
+        row['watch'].configure(image=icon('streaming_icon'), width=0, height=0)
+        return
+    image = icon('streaming_icon')
+    if login in thumbnail_images:
+        thumbnail_images.move_to_end(login)
+        image = thumbnail_images[login][0]
+    row['watch'].configure(image=image, width=thumbnails.width,
+                            height=thumbnails.height)
+
+def schedule_thumbnails():
+    global thumbnails_pending
+    if thumbnails_enabled() and not thumbnails_pending:
+        thumbnails_pending = True
+        root.after_idle(request_visible_thumbnails)
+
+def request_visible_thumbnails():
+    '''Requests thumbnails for the online streamers in the visible part of
+    the canvas. Rows out of view never cause a download.
+    '''
+    global thumbnails_pending
+    thumbnails_pending = False
+    if virtual_list:
+        rows = list(visible_rows.values())
+    else:
+        top = meta_canvas.canvasy(0)
+        bottom = top + meta_canvas.winfo_height()
+        rows = [row for row in streamer_rows.values()
+                if row['position'] is not None
+                and row['frame'].winfo_y() < bottom
+                and row['frame'].winfo_y() + row['frame'].winfo_height() > top]
+    for row in rows:
+        package = row['package']
+        if package is not None and package.online and package.thumbnail_url:
+            request_thumbnail(package)
+
+def request_thumbnail(package):
+    '''Starts fetching a thumbnail that isn't in memory or is older than the
+    cache TTL. Failed streamers are retried after the TTL, too.
+    '''
+    global thumbnails_polling
+    login = package.login
+    now = time.time()
+    if login in thumbnail_jobs:
+        return
+    if login in thumbnail_images \
+            and now - thumbnail_images[login][1] < thumbnails.cache_ttl:
+        return
+    if now - thumbnail_failures.get(login, 0) < thumbnails.cache_ttl:
+        return
+    thumbnail_jobs[login] = thumbnails.fetch_async(login, package.thumbnail_url)
+    if not thumbnails_polling:
+        thumbnails_polling = True
+        root.after(100, poll_thumbnails)
+
+def poll_thumbnails():
+    '''Decodes the finished thumbnails into the PhotoImage LRU and shows
+    them in the rows of their streamers.
+    '''
+    global thumbnails_polling
+    for login, job in list(thumbnail_jobs.items()):
+        if not job.done():
+            continue
+        del thumbnail_jobs[login]
+        try:
+            image = tk.PhotoImage(data=job.result())
+        except Exception:
+            thumbnail_failures[login] = time.time()
+            continue
+        thumbnail_images[login] = (image, time.time())
+        thumbnail_images.move_to_end(login)
+        while len(thumbnail_images) > twitchapi.get_setting(
+                                            'thumbnail_memory_entries', 100):
+            # Rows still showing the image fall back to the streaming icon
+            # before Tk deletes it:
+            evicted, entry = thumbnail_images.popitem(last=False)
+            for row in rows_of(evicted):
+                show_thumbnail(row, evicted)
+            del entry
+        for row in rows_of(login):
+            show_thumbnail(row, login)
+    if thumbnail_jobs:
+        root.after(100, poll_thumbnails)
+    else:
+        thumbnails_polling = False
+
+def change_thumbnails(value):
+    '''Rebuilds the rows, because thumbnails change the row height.
+    '''
+    twitchapi.change_settings_file('thumbnails', value)
+    switch_list_mode(virtual_list)
+    streamer_buttons()
+
+def draw_info(row):
+    if not row['expanded']:
+        row['info'].grid_remove()
+        return
+    package = row['package']
+    row['history'] = history_info(package.login)
+    viewers, usually_live = row['history']
+    if package.online:
+        row['info'].configure(text=f'Title: {package.title}\n'
+                                f'Category: {package.category}\n'
+                                f'Viewer count: {package.viewers}\n'
+                                f'History: {viewers}\n'
+                                f'Usually live: {usually_live}'
+                                )
+        row['info'].grid(row=1, column=1, columnspan=3, sticky='w', padx=10)
+    else:
+        row['info'].configure(text=f'Last seen: '
+                                f'{twitchapi.last_seen(package.login)}\n'
+                                f'Usually live: {usually_live}'
+                                )
+        row['info'].grid(row=1, column=1, columnspan=3, sticky='w', padx=0)
+
+def history_info(login):
+    '''Returns a sparkline of the recent viewer counts and the hours in
+    which the streamer is usually live. Both always take one line, so the
+    virtual list can measure the row height without a history.
+    '''
+    summary = history.summary(login)
+    if summary is None:
+        return 'not recorded yet', 'unknown'
+    viewers, hours = summary
+    line = history.sparkline(viewers)
+    if line is not None:
+        line = f'{line} (up to {max(viewers)})'
+    live = history.usually_live(hours)
+    if live is not None and (live[1] + 1) % 24 == live[0]:
+        live = 'around the clock'
+    elif live is not None:
+        live = f'{live[0]:02d}:00 - {(live[1] + 1) % 24:02d}:00'
+    return line or 'not recorded yet', live or 'unknown'
+
+def poll_history(job):
+    '''Redraws the expanded rows once the history was read at startup.
+    '''
+    if not job.done():
+        root.after(100, poll_history, job)
+        return
+    if job.exception() is None:
+        streamer_buttons()
+
+def toggle_info(login):
+    if login in expanded_streamers:
+        expanded_streamers.remove(login)
+    else:
+        expanded_streamers.add(login)
+    if virtual_list:
+        # The row height changes, so the rows below have to move:
+        layout_virtual_rows()
+    else:
+        row = streamer_rows[login]
+        row['expanded'] = is_expanded(login, row['package'])
+        draw_info(row)
 
 def error_dialog(e):
     messagebox.showerror(title='Error',
@@ -227,21 +815,99 @@ def unfollow_dialog(streamer):
                         )
     if answer:
         twitchapi.unfollow_streamer(streamer)
-        refresh_main()
+        # The cached status still covers the remaining streamers:
+        refresh_main_quiet()
 
 def follow_dialog():
-    '''Opens a text dialog and adds the entered string to the follow list.
+    '''Opens a text dialog and adds the entered names to the follow list.
+    Several names can be separated by spaces or commas.
     '''
     answer = simpledialog.askstring(title='Follow',
-                        prompt='Enter streamer name: ',
+                        prompt='Enter streamer names: ',
                         parent=root
                         )
     if answer is None or len(answer) == 0:
         return
     else:
-        twitchapi.follow_streamer(answer)
+        if twitchapi.follow_streamers(answer.replace(',', ' ').split()):
+            refresh_main()
+
+def import_follow_list():
+    '''Follows all streamers in a text, CSV or JSON file, with one write of
+    the config and one refresh afterwards.
+    '''
+    path = filedialog.askopenfilename(title='Import follow list',
+                        filetypes=[('Follow lists', '*.txt *.csv *.json'),
+                                    ('All files', '*')],
+                        parent=settings_window
+                        )
+    if not path:
+        return
+    try:
+        added = twitchapi.follow_streamers(twitchapi.read_follow_list(path))
+    except (OSError, ValueError, KeyError, TypeError) as e:
+        messagebox.showerror(title='Import failed', message=str(e),
+                            parent=settings_window)
+        return
+    messagebox.showinfo(title='Import',
+                        message=f'Followed {len(added)} new streamers.',
+                        parent=settings_window)
+    if added:
         refresh_main()
 
+def unfollow_list():
+    '''Unfollows all streamers in a text, CSV or JSON file, after asking for
+    confirmation, with one write of the config and one redraw afterwards.
+    '''
+    path = filedialog.askopenfilename(title='Unfollow streamers in a file',
+                        filetypes=[('Follow lists', '*.txt *.csv *.json'),
+                                    ('All files', '*')],
+                        parent=settings_window
+                        )
+    if not path:
+        return
+    try:
+        names = twitchapi.read_follow_list(path)
+    except (OSError, ValueError, KeyError, TypeError) as e:
+        messagebox.showerror(title='Unfollow failed', message=str(e),
+                            parent=settings_window)
+        return
+    listed = {name.strip().lower() for name in names}
+    followed = [name for name in twitchapi.followed_streamers()
+                if name.lower() in listed]
+    if not followed:
+        messagebox.showinfo(title='Unfollow',
+                            message='None of these streamers is followed.',
+                            parent=settings_window)
+        return
+    answer = messagebox.askyesno(title='Unfollow',
+                        message='Are you sure that you want to unfollow '
+                                f'{len(followed)} streamers?',
+                        default='no',
+                        parent=settings_window
+                        )
+    if answer:
+        twitchapi.unfollow_streamers(followed)
+        # The cached status still covers the remaining streamers:
+        refresh_main_quiet()
+
+def export_follow_list():
+    '''Saves the follow list as text, CSV or JSON, by the file extension.
+    '''
+    path = filedialog.asksaveasfilename(title='Export follow list',
+                        defaultextension='.txt',
+                        filetypes=[('Text', '*.txt'), ('CSV', '*.csv'),
+                                    ('JSON', '*.json')],
+                        parent=settings_window
+                        )
+    if not path:
+        return
+    try:
+        twitchapi.write_follow_list(path, twitchapi.followed_streamers())
+    except OSError as e:
+        messagebox.showerror(title='Export failed', message=str(e),
+                            parent=settings_window)
+
 def play_dialog():
     '''Opens a text dialog to play a custom stream
     '''
@@ -253,7 +919,55 @@ def play_dialog():
     if streamer is None or len(streamer) == 0:
         return
     else:
-        update = twitchapi.start_stream(streamer)
+        watch_stream(streamer)
+
+def watch_stream(streamer):
+    if twitchapi.start_stream(streamer):
+        players_changed(streamer)
+
+def watch_vod(streamer, vod):
+    if twitchapi.start_vod(streamer, vod):
+        players_changed(streamer)
+
+def players_changed(streamer):
+    '''Updates the streamer's row and the list of playing streams in the
+    status bar, and starts to check for exited players.
+    '''
+    global players_polling
+    for row in rows_of(streamer):
+        update_row(row, streamer, streamer_packages[streamer])
+    playing = []
+    for key in twitchapi.players:
+        if key[0] == 'stream':
+            playing.append(key[1])
+        else:
+            playing.append(f'{key[1]} (VOD {key[2]})')
+    if playing:
+        show_status('players', f'Playing: {", ".join(playing)}')
+    else:
+        hide_status('players')
+    if playing and not players_polling:
+        players_polling = True
+        root.after(1000, poll_players)
+
+def poll_players():
+    global players_polling
+    for key in twitchapi.reap_players():
+        players_changed(key[1])
+    if twitchapi.players:
+        root.after(1000, poll_players)
+    else:
+        players_polling = False
+
+def rows_of(streamer):
+    '''Returns the rows that currently show the streamer.
+    '''
+    if virtual_list:
+        return [row for row in visible_rows.values()
+                if row['login'] == streamer]
+    if streamer in streamer_rows:
+        return [streamer_rows[streamer]]
+    return []
 
 def refresh_main_quiet():
     '''Refresh the main panel without running wtwitch c to avoid unnecessary
@@ -264,29 +978,124 @@ def refresh_main_quiet():
         streamer_status = twitchapi.extract_streamer_status()
     except Exception as e:
         error_dialog(e)
-    twitchapi.extract_streamer_status()
-    for widget in main_frame.winfo_children():
-        widget.destroy()
     streamer_buttons()
 
-def refresh_main():
-    '''Runs wtwitch c and then rebuilds the main panel.
+def refresh_main(manual=True):
+    '''Runs wtwitch c in the background and rebuilds the main panel once the
+    new status has arrived. Clicks during a running refresh join that refresh.
+    Only failures of manual refreshes open an error dialog.
+    '''
+    global refresh_job
+    global refresh_manual
+    refresh_manual = refresh_manual or manual
+    if refresh_job is not None:
+        return
+    refresh_job = twitchapi.check_status_async()
+    show_status('refresh', 'Refreshing…')
+    root.after(100, poll_refresh)
+
+def poll_refresh():
+    '''Checks every 100 ms if the background refresh is done and swaps in the
+    new streamer status.
     '''
-    twitchapi.check_status()
+    global refresh_job
+    global refresh_manual
     global streamer_status
+    if not refresh_job.done():
+        root.after(100, poll_refresh)
+        return
+    finished_job = refresh_job
+    manual = refresh_manual
+    refresh_job = None
+    refresh_manual = False
+    hide_status('refresh')
+    # The Helix backend falls back to wtwitch c, but its error is shown:
+    helix_error = twitchapi.helix_state['error']
+    if helix_error is not None:
+        show_status('helix', f'Twitch API failed, using wtwitch: '
+                            f'{str(helix_error)[:100]}')
+    else:
+        hide_status('helix')
     try:
-        streamer_status = twitchapi.extract_streamer_status()
+        streamer_status = finished_job.result()
     except Exception as e:
-        error_dialog(e)
-    for widget in main_frame.winfo_children():
-        widget.destroy()
+        auto_refresh['failures'] += 1
+        schedule_auto_refresh()
+        if manual:
+            error_dialog(e)
+        else:
+            show_status('refresh failed', 'Refresh failed, retrying later')
+        return
+    finally:
+        if 'live status' not in startup_phases:
+            startup_phase('live status')
+            startup_report()
+    auto_refresh['failures'] = 0
+    schedule_auto_refresh()
+    hide_status('refresh failed')
+    hide_status('stale')
     streamer_buttons()
 
+def schedule_auto_refresh():
+    '''Schedules the next automatic refresh auto_refresh minutes after the
+    last refresh, so a manual refresh also pushes the next one back. Failed
+    refreshes double the delay, up to an hour. Up to 10 % jitter keeps many
+    clients from refreshing in lockstep.
+    '''
+    if auto_refresh['after'] is not None:
+        root.after_cancel(auto_refresh['after'])
+        auto_refresh['after'] = None
+    interval = twitchapi.get_setting('auto_refresh', 5) * 60
+    if interval <= 0:
+        return
+    delay = interval * 2 ** min(auto_refresh['failures'], 10)
+    delay = min(delay, max(interval, 3600))
+    delay *= random.uniform(0.9, 1.1)
+    auto_refresh['after'] = root.after(int(delay * 1000), auto_refresh_due)
+
+def auto_refresh_due():
+    '''Runs the automatic refresh, unless the window is minimized. Then it
+    waits until the window is shown again.
+    '''
+    auto_refresh['after'] = None
+    if root.state() == 'iconic':
+        auto_refresh['paused'] = True
+        return
+    refresh_main(manual=False)
+
+def window_mapped(event):
+    if event.widget is root and auto_refresh['paused']:
+        auto_refresh['paused'] = False
+        auto_refresh_due()
+
+def show_status(key, text):
+    '''Shows a message in the status bar below the list. Messages of running
+    background jobs are kept by key, so they can be removed independently.
+    '''
+    status_messages[key] = text
+    status_bar.configure(text='\n'.join(status_messages.values()))
+    status_bar.grid(row=2, column=0, sticky='ew', padx=5)
+
+def hide_status(key):
+    status_messages.pop(key, None)
+    if status_messages:
+        status_bar.configure(text='\n'.join(status_messages.values()))
+    else:
+        status_bar.grid_remove()
+
 def resize_meta_canvas(e):
     meta_canvas.itemconfig(meta_canvas_window, width=e.width)
 
-def mouse_scroll(event):
-    meta_canvas.yview_scroll(int(-1 * (event.delta / 120)), "units")
+def bind_wheel(widget, canvas):
+    '''Scrolls the canvas with the mouse wheel over the widget. X11 reports
+    the wheel as buttons 4 and 5.
+    '''
+    widget.bind("<MouseWheel>", lambda e: mouse_scroll(e, canvas))
+    widget.bind("<Button-4>", lambda e: canvas.yview_scroll(-1, "units"))
+    widget.bind("<Button-5>", lambda e: canvas.yview_scroll(1, "units"))
+
+def mouse_scroll(event, canvas):
+    canvas.yview_scroll(int(-1 * (event.delta / 120)), "units")
 
 def draw_main():
     '''The main window. Calls streamer_buttons() twice, to draw buttons for
@@ -296,20 +1105,29 @@ def draw_main():
     meta_frame = ttk.Frame(root)
     meta_frame.grid(row=0, column=0, sticky='nsew')
     meta_frame.columnconfigure(0, weight=1)
-    meta_frame.rowconfigure(0, weight=1)
+    meta_frame.rowconfigure(1, weight=1)
+    filter_frame = ttk.Frame(meta_frame)
+    filter_frame.grid(row=0, column=0, columnspan=2, sticky='ew')
+    filter_frame.columnconfigure(1, weight=1)
+    filter_label = ttk.Label(filter_frame, text='Filter', font=small_font)
+    filter_label.grid(row=0, column=0, padx=5)
+    filter_entry = ttk.Entry(filter_frame, textvariable=filter_text)
+    filter_entry.grid(row=0, column=1, sticky='ew', padx=(0, 5), pady=3)
+    filter_entry.bind('<Escape>', lambda e: filter_text.set(''))
     global meta_canvas
     meta_canvas = tk.Canvas(meta_frame, highlightthickness='0')
-    meta_canvas.grid(row=0, column=0, sticky="nsew")
+    meta_canvas.grid(row=1, column=0, sticky="nsew")
     meta_canvas.columnconfigure(0, weight=1)
     meta_canvas.rowconfigure(0, weight=1)
-    scrollbar = ttk.Scrollbar(meta_frame,
+    global main_scrollbar
+    main_scrollbar = ttk.Scrollbar(meta_frame,
                         orient="vertical", command=meta_canvas.yview)
-    scrollbar.grid(row=0, column=1, sticky="ns")
-    meta_canvas.configure(yscrollcommand=scrollbar.set)
+    main_scrollbar.grid(row=1, column=1, sticky="ns")
+    meta_canvas.configure(yscrollcommand=schedule_render)
     global main_frame
     main_frame = ttk.Frame(meta_canvas)
     main_frame.grid(row=0, column=0, sticky='nsew')
-    main_frame.columnconfigure(1, weight=1)
+    main_frame.columnconfigure(0, weight=1)
     main_frame.bind("<Configure>", lambda e:
                         meta_canvas.configure(
                         scrollregion=meta_canvas.bbox("all")
@@ -318,7 +1136,8 @@ def draw_main():
     global meta_canvas_window
     meta_canvas_window = meta_canvas.create_window((0, 0), window=main_frame, anchor="nw")
     meta_canvas.bind("<Configure>", resize_meta_canvas)
-    meta_canvas.bind("<MouseWheel>", mouse_scroll)
+    bind_wheel(meta_canvas, meta_canvas)
+    bind_wheel(main_frame, meta_canvas)
     # Draw main content:
     streamer_buttons()
 
@@ -360,21 +1179,23 @@ def change_info_preset(value):
     else:
         twitchapi.change_settings_file('show_info', value)
         current_info_setting = preset_info_setting
+        expanded_streamers.clear()
         refresh_main_quiet()
 
 def settings_dialog():
     '''Opens a toplevel window with four settings options.
     '''
+    player, quality = twitchapi.check_config()[:2]
     global selected_player
     selected_player = tk.StringVar()
-    if twitchapi.check_config()[0] in ['mpv', 'vlc']:
-        selected_player.set(twitchapi.check_config()[0])
+    if player in ['mpv', 'vlc']:
+        selected_player.set(player)
     else:
         selected_player.set('custom')
     global selected_quality
     selected_quality = tk.StringVar()
-    if twitchapi.check_config()[1] in ['best', '720p,720p60,480p,best', '480p,worst']:
-        selected_quality.set(twitchapi.check_config()[1])
+    if quality in ['best', '720p,720p60,480p,best', '480p,worst']:
+        selected_quality.set(quality)
     else:
         selected_quality.set('custom')
     global settings_window
@@ -451,14 +1272,75 @@ def settings_dialog():
                 command=lambda t=theme_name: style.theme_use(t)
                 )
         pick_theme.pack(expand=True, fill='both')
+    global prefetch_setting
+    prefetch_setting = tk.StringVar()
+    prefetch_setting.set(twitchapi.get_setting('vod_prefetch', 'off'))
+    prefetch_f = ttk.LabelFrame(meta_frame, text='Prefetch VODs')
+    prefetch_f.pack(anchor='nw', padx=5, pady=5)
+    for value, text in [('off', 'Off'), ('offline', 'Offline'), ('all', 'All')]:
+        pick_prefetch = ttk.Radiobutton(prefetch_f,
+                text=text,
+                value=value,
+                variable=prefetch_setting,
+                command=lambda v=value: change_prefetch(v)
+                )
+        pick_prefetch.pack(side='left', expand=True, fill='both')
+    global sort_setting
+    sort_setting = tk.StringVar()
+    sort_setting.set(twitchapi.get_setting('sort_mode', 'name'))
+    sort_f = ttk.LabelFrame(meta_frame, text='Sort by')
+    sort_f.pack(anchor='nw', padx=5, pady=5)
+    for value, text in [('name', 'Name'), ('viewers', 'Viewers'),
+                        ('category', 'Category'), ('last_seen', 'Last seen')]:
+        pick_sort = ttk.Radiobutton(sort_f,
+                text=text,
+                value=value,
+                variable=sort_setting,
+                command=lambda v=value: change_sort('sort_mode', v)
+                )
+        pick_sort.pack(side='left', expand=True, fill='both')
+    global group_setting
+    group_setting = tk.StringVar()
+    group_setting.set(twitchapi.get_setting('group_by_category', 'no'))
+    group_check = ttk.Checkbutton(sort_f, text='Group by category',
+                variable=group_setting, onvalue='yes', offvalue='no',
+                command=lambda: change_sort('group_by_category',
+                                            group_setting.get())
+                )
+    group_check.pack(side='left', expand=True, fill='both')
+    global thumbnail_setting
+    thumbnail_setting = tk.StringVar()
+    thumbnail_setting.set(twitchapi.get_setting('thumbnails', 'off'))
+    thumbnail_f = ttk.LabelFrame(meta_frame, text='Thumbnails')
+    thumbnail_f.pack(anchor='nw', padx=5, pady=5)
+    thumbnail_check = ttk.Checkbutton(thumbnail_f, text='Show stream previews',
+                variable=thumbnail_setting, onvalue='on', offvalue='off',
+                command=lambda: change_thumbnails(thumbnail_setting.get())
+                )
+    if thumbnails.Image is None:
+        thumbnail_setting.set('off')
+        thumbnail_check.configure(text='Show stream previews (needs Pillow)',
+                                    state='disabled')
+    thumbnail_check.pack(side='left', expand=True, fill='both')
+    follow_list_f = ttk.LabelFrame(meta_frame, text='Follow list')
+    follow_list_f.pack(anchor='nw', padx=5, pady=5)
+    import_button = ttk.Button(follow_list_f, text='Import',
+                command=lambda: import_follow_list())
+    import_button.pack(side='left', padx=5, pady=5)
+    export_button = ttk.Button(follow_list_f, text='Export',
+                command=lambda: export_follow_list())
+    export_button.pack(side='left', padx=5, pady=5)
+    unfollow_button = ttk.Button(follow_list_f, text='Unfollow from file',
+                command=lambda: unfollow_list())
+    unfollow_button.pack(side='left', padx=5, pady=5)
 
 def set_quick_toggle_icon():
     global current_info_setting
     global current_quick_toggle_icon
     if current_info_setting == 'no':
-        current_quick_toggle_icon = expand_icon
+        current_quick_toggle_icon = icon('expand_icon')
     else:
-        current_quick_toggle_icon = collapse_icon
+        current_quick_toggle_icon = icon('collapse_icon')
     return current_quick_toggle_icon
 
 def info_quick_toggle():
@@ -468,8 +1350,17 @@ def info_quick_toggle():
     else:
         twitchapi.change_settings_file('show_info', 'no')
     current_info_setting = twitchapi.get_setting('show_info')
+    expanded_streamers.clear()
     refresh_main_quiet()
 
+def icon(name):
+    '''Returns the icon as a PhotoImage. Tk decodes it straight from the
+    base64 data in encoded_images the first time the icon is needed.
+    '''
+    if name not in icons:
+        icons[name] = tk.PhotoImage(data=twitchapi.icon_data(name))
+    return icons[name]
+
 def menu_bar():
     '''The menu bar of the root window.
     '''
@@ -483,7 +1374,7 @@ def menu_bar():
                         command=lambda: follow_dialog())
     menubar.add_command(label='Play', font=cantarell_12,
                         command=lambda: play_dialog())
-    menubar.add_command(image=settings_icon, font=cantarell_12,
+    menubar.add_command(image=icon('settings_icon'), font=cantarell_12,
                         command=lambda: settings_dialog())
     menubar.add_command(image=current_quick_toggle_icon, font=cantarell_12,
                         command=lambda: [info_quick_toggle(),
@@ -492,9 +1383,16 @@ def menu_bar():
                                         image=current_quick_toggle_icon)
                                         ]
                                     )
+    if tracing.enabled:
+        menubar.add_command(label='Trace', font=cantarell_12,
+                            command=lambda: trace_window())
 
 def save_window_size(event):
-    twitchapi.change_settings_file('window_size', root.wm_geometry())
+    '''Bindings on root also fire for all its children, so only save the
+    geometry when the window itself is destroyed.
+    '''
+    if event.widget is root:
+        twitchapi.change_settings_file('window_size', root.wm_geometry())
 
 def initiate_window_dimensions():
     """Sets the default window length, depending on the number of streamers in
@@ -514,25 +1412,115 @@ def initiate_window_dimensions():
             window_height = str(variable_height)
         return f'330x{window_height}'
 
+def startup_phase(name):
+    '''Records the time since the last phase of the startup.
+    '''
+    global startup_last_phase
+    now = time.perf_counter()
+    startup_phases[name] = now - startup_last_phase
+    startup_last_phase = now
+
+def startup_report():
+    '''Prints the duration of each startup phase to stderr, if main.py was
+    started with --startup-timing.
+    '''
+    if '--startup-timing' not in sys.argv:
+        return
+    total = 0
+    for name, duration in startup_phases.items():
+        total += duration
+        print(f'{name:>16}: {duration * 1000:8.1f} ms'
+                f'  (at {total * 1000:8.1f} ms)', file=sys.stderr)
+
+def trace_file():
+    """Returns the file given with --trace FILE, or None without --trace.
+    """
+    if '--trace' not in sys.argv:
+        return None
+    position = sys.argv.index('--trace') + 1
+    if position < len(sys.argv) and not sys.argv[position].startswith('--'):
+        return sys.argv[position]
+    return 'wince-trace.json'
+
+def export_trace():
+    """Writes the recorded spans as Chrome trace JSON, if main.py was
+    started with --trace.
+    """
+    path = trace_file()
+    if path is not None:
+        tracing.export_chrome_trace(path)
+        print(f'Trace written to {path}', file=sys.stderr)
+
+def trace_window():
+    """Shows the recent spans per function and the wtwitch run times. The
+    table is updated every second while the window is open.
+    """
+    window = tk.Toplevel(master=root)
+    window.title('Trace')
+    window.columnconfigure(0, weight=1)
+    window.rowconfigure(0, weight=1)
+    columns = ('count', 'p50', 'p95', 'max')
+    table = ttk.Treeview(window, columns=columns)
+    table.heading('#0', text='Span')
+    table.column('#0', width=180)
+    for column in columns:
+        table.heading(column, text=column)
+        table.column(column, width=70, anchor='e')
+    table.grid(row=0, column=0, sticky='nsew')
+    def update_table():
+        if not window.winfo_exists():
+            return
+        table.delete(*table.get_children())
+        rows = sorted(tracing.percentiles().items())
+        rows += sorted((f'wtwitch {subcommand}', tracing.summarize(durations))
+                        for subcommand, durations
+                        in twitchapi.command_durations().items())
+        for name, (count, p50, p95, maximum) in rows:
+            table.insert('', 'end', text=name,
+                        values=(count, f'{p50 * 1000:.1f} ms',
+                                f'{p95 * 1000:.1f} ms',
+                                f'{maximum * 1000:.1f} ms'))
+        window.after(1000, update_table)
+    update_table()
+
+def load_cached_status():
+    '''Reads the status of the last wtwitch c run. Without a subscription
+    cache, all followed streamers are shown offline until the refresh.
+    '''
+    try:
+        return twitchapi.extract_streamer_status()
+    except Exception:
+        try:
+            subscriptions = twitchapi.load_config()[1]['subscriptions']
+        except Exception:
+            subscriptions = []
+        return twitchapi.index_streamer_status([], subscriptions)
+
 def toggle_settings():
     """Checks if wtwitch prints offline streamers and color output. Latter is
     needed to filter wtwitch output with regex.
     """
-    if twitchapi.check_config()[2] == 'false':
+    user_config = twitchapi.check_config()
+    if user_config[2] == 'false':
         twitchapi.adjust_config('colors', 'true')
-    if twitchapi.check_config()[3] == 'false':
+    if user_config[3] == 'false':
         twitchapi.adjust_config('printOfflineSubscriptions', 'true')
 
+# Record spans of the hot paths with --trace, see trace_window():
+if trace_file() is not None:
+    tracing.enable()
+# Durations of the startup phases, see startup_report():
+startup_phases = {}
+startup_last_phase = startup_started
 # Make sure that colors in the terminal output are activated:
 toggle_settings()
-# Check the online/offline status once before window initialization:
-twitchapi.check_status()
-try:
-    streamer_status = twitchapi.extract_streamer_status()
-except Exception as e:
-    error_dialog(e)
+startup_phase('config')
+# Start with the status of the last run, wtwitch c follows in the background:
+streamer_status = load_cached_status()
+startup_phase('cached status')
 # Create a gwt-specific settings file:
 twitchapi.create_settings_file()
+startup_phase('settings')
 
 # Create the main window
 root = tk.Tk(className='Wince')
@@ -540,39 +1528,96 @@ root.title("Wince")
 root.geometry(initiate_window_dimensions())
 root.minsize(285, 360)
 root.bind("<Destroy>", save_window_size)
+root.bind("<Map>", window_mapped)
 root.columnconfigure(0, weight=1)
 root.rowconfigure(0, weight=1)
 
+# Currently running background refresh, and whether it was started by hand:
+refresh_job = None
+refresh_manual = False
+# State of the automatic refresh, see schedule_auto_refresh():
+auto_refresh = {'after': None, 'failures': 0, 'paused': False}
+# Messages in the status bar, keyed by job:
+status_messages = {}
+# Whether poll_players() is scheduled:
+players_polling = False
+# Running VOD prefetch, keyed by streamer:
+prefetch_jobs = {}
+# The VOD panel, the VODs it shows and the streamer whose VODs were
+# requested last. Its rows are reused and drawn in pages:
+vod_panel_frame = None
+vod_panel_streamer = None
+vod_panel_vods = []
+vod_panel_requested = None
+vod_rows = []
+vod_rows_shown = 0
+vod_page_size = 15
+
 # Fonts:
 small_font = ('', 10)
 cantarell_12 = ('Cantarell', 12)
 cantarell_12_bold = ('Cantarell', 12, 'bold')
 cantarell_13_bold = ('Cantarell', 13, 'bold')
 
-# Import icons:
-icon_files = twitchapi.icon_paths()
-unfollow_icon = tk.PhotoImage(file=icon_files['unfollow_icon'])
-vod_icon = tk.PhotoImage(file=icon_files['vod_icon'])
-streaming_icon = tk.PhotoImage(file=icon_files['streaming_icon'])
-offline_icon = tk.PhotoImage(file=icon_files['offline_icon'])
-play_icon = tk.PhotoImage(file=icon_files['play_icon'])
-close_icon = tk.PhotoImage(file=icon_files['close_icon'])
-settings_icon = tk.PhotoImage(file=icon_files['settings_icon'])
-
-expand_icon = tk.PhotoImage(file=icon_files['expand_icon'])
-collapse_icon = tk.PhotoImage(file=icon_files['collapse_icon'])
-
-app_icon = tk.PhotoImage(file=icon_files['app_icon'])
-root.iconphoto(False, app_icon)
-
-# Variables to collect stream info
-# and settings value to show info for all streamers:
-show_info_status = {}
-info_content = {}
+# Icons are decoded on first use:
+icons = {}
+root.iconphoto(False, icon('app_icon'))
+
+# One row of widgets per followed streamer, keyed by login:
+streamer_rows = {}
+streamer_packages = {}
+row_order = []
+# Streamers whose info was expanded by hand:
+expanded_streamers = set()
+# Virtual list for long follow lists. Only the visible rows (plus overscan)
+# exist and get recycled while scrolling:
+virtual_list = False
+virtual_list_threshold = 200
+overscan_rows = 5
+visible_rows = {}
+spare_rows = []
+row_heights = {}
+row_offsets = []
+render_pending = False
+# Group headers, keyed by ('category', name) or ('offline',), and the
+# logins in each sort mode of the current status:
+header_rows = {}
+header_texts = {}
+sort_state = {'status': None, 'orders': {}}
+# Stream thumbnails: decoded PhotoImages with their load time, least
+# recently shown first, running downloads and failed downloads, keyed by
+# login:
+thumbnail_images = OrderedDict()
+thumbnail_jobs = {}
+thumbnail_failures = {}
+thumbnails_pending = False
+thumbnails_polling = False
+# Text of the filter entry and the search index of the status it was
+# built from, see filter_order():
+filter_text = tk.StringVar()
+filter_text.trace_add('write', filter_changed)
+search_state = {'status': None, 'index': None}
+# Settings value to show info for all streamers:
 preset_info_setting = tk.StringVar()
 preset_info_setting = twitchapi.get_setting('show_info_preset')
 current_info_setting = twitchapi.get_setting('show_info')
 
+status_bar = ttk.Label(root, anchor='w', font=small_font)
+startup_phase('window')
+
 menu_bar()
+startup_phase('menu')
 draw_main()
-root.mainloop()
\ No newline at end of file
+startup_phase('list')
+# Idle callbacks run in order, so this one runs after the first redraw:
+root.after_idle(startup_phase, 'first paint')
+show_status('stale', 'Showing the status of the last refresh')
+poll_history(twitchapi.load_history_async())
+refresh_main()
+root.after(5000, schedule_prefetch)
+# Importing main builds the window without running it, e.g. for the load
+# harness in benchmarks/:
+if __name__ == '__main__':
+    root.mainloop()
+    twitchapi.save_settings()
+    export_trace()
\ No newline at end of file
@@ -0,0 +1,123 @@
+#!/usr/bin/env python
+
+import os
+import io
+import sys
+import time
+import base64
+import tempfile
+import threading
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+
+# Twitch serves JPEG thumbnails, which Tk can't read, so they are converted
+# with Pillow. Without it, main.py turns thumbnails off:
+try:
+    from PIL import Image
+except ImportError:
+    Image = None
+
+# Size of the thumbnails, filled into the {width}x{height} URL template:
+width = 80
+height = 45
+timeout = 5
+# Twitch renews stream thumbnails every few minutes:
+cache_ttl = 300
+cache_max_bytes = 10000000
+max_workers = 4
+
+# Downloads run on the worker pool. Requests for a streamer whose
+# thumbnail is already being fetched share its future:
+worker = ThreadPoolExecutor(max_workers=max_workers)
+jobs = {}
+jobs_lock = threading.Lock()
+
+def thumbnails_dir():
+    return f'{sys.path[0]}/thumbnails'
+
+def cache_file(login):
+    return f'{thumbnails_dir()}/{login.lower()}'
+
+def fetch_async(login, url_template):
+    '''Return a future with the streamer's thumbnail as base64 PNG or GIF
+    data for tk.PhotoImage. The disk cache is read and the image downloaded
+    and converted on a worker thread.
+    '''
+    with jobs_lock:
+        job = jobs.get(login)
+        if job is None:
+            job = worker.submit(fetch, login, url_template)
+            jobs[login] = job
+            job.add_done_callback(lambda job: forget_job(login, job))
+        return job
+
+def forget_job(login, job):
+    with jobs_lock:
+        if jobs.get(login) is job:
+            del jobs[login]
+
+def fetch(login, url_template):
+    '''Return the cached thumbnail if it is younger than cache_ttl, or
+    download it. Raises OSError or ValueError, if that failed.
+    '''
+    path = cache_file(login)
+    try:
+        if time.time() - os.path.getmtime(path) < cache_ttl:
+            with open(path, 'rb') as cached:
+                return base64.b64encode(cached.read())
+    except OSError:
+        pass
+    url = url_template.replace('{width}', str(width)) \
+                        .replace('{height}', str(height))
+    with urllib.request.urlopen(url, timeout=timeout) as response:
+        data = convert(response.read())
+    os.makedirs(thumbnails_dir(), exist_ok=True)
+    fd, temp_path = tempfile.mkstemp(dir=thumbnails_dir(), prefix='.tmp-')
+    try:
+        with os.fdopen(fd, 'wb') as new_file:
+            new_file.write(data)
+        os.replace(temp_path, path)
+    except:
+        os.remove(temp_path)
+        raise
+    evict()
+    return base64.b64encode(data)
+
+def convert(data):
+    '''Return the image as a PNG of width x height, which Tk can read.
+    Raises ValueError if Pillow can't read it.
+    '''
+    try:
+        image = Image.open(io.BytesIO(data))
+        image = image.convert('RGB').resize((width, height))
+    except Exception as e:
+        raise ValueError(f'unreadable thumbnail: {e}') from e
+    png = io.BytesIO()
+    image.save(png, format='PNG')
+    return png.getvalue()
+
+def evict():
+    '''Delete the least recently written thumbnails, until the cache holds at
+    most cache_max_bytes.
+    '''
+    cache_files = []
+    total_size = 0
+    with os.scandir(thumbnails_dir()) as entries:
+        for entry in entries:
+            if entry.is_file() and not entry.name.startswith('.tmp-'):
+                # Concurrent evictions delete each other's files:
+                try:
+                    stat = entry.stat()
+                except FileNotFoundError:
+                    continue
+                cache_files.append((stat.st_mtime, stat.st_size, entry.path))
+                total_size += stat.st_size
+    cache_files.sort()
+    for mtime, size, path in cache_files:
+        if total_size <= cache_max_bytes:
+            break
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+        total_size -= size
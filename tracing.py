@@ -0,0 +1,70 @@
+#!/usr/bin/env python
+
+import json
+import time
+import threading
+import functools
+from collections import deque
+
+# Tracing is off by default. The traced functions then only pay for one
+# check of this flag:
+enabled = False
+# The most recent spans as (name, start, duration, thread id), in seconds
+# of time.perf_counter():
+spans = deque(maxlen=5000)
+
+def traced(name):
+    '''Decorator that records a span for every call of the function, while
+    tracing is enabled.
+    '''
+    def decorator(function):
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            if not enabled:
+                return function(*args, **kwargs)
+            start = time.perf_counter()
+            try:
+                return function(*args, **kwargs)
+            finally:
+                spans.append((name, start, time.perf_counter() - start,
+                                threading.get_ident()))
+        return wrapper
+    return decorator
+
+def enable():
+    global enabled
+    enabled = True
+
+def percentiles():
+    '''Return the number of recent spans and their median, 95th percentile
+    and maximum duration in seconds, keyed by span name.
+    '''
+    durations = {}
+    for name, start, duration, thread in list(spans):
+        durations.setdefault(name, []).append(duration)
+    return {name: summarize(values) for name, values in durations.items()}
+
+def summarize(durations):
+    '''Return the count, median, 95th percentile and maximum of durations.
+    '''
+    values = sorted(durations)
+    return (len(values),
+            values[len(values) // 2],
+            values[min(int(len(values) * 0.95), len(values) - 1)],
+            values[-1])
+
+def export_chrome_trace(path):
+    '''Write the recent spans in the Chrome trace event format, which
+    chrome://tracing and Perfetto can open.
+    '''
+    events = []
+    for name, start, duration, thread in list(spans):
+        events.append({'name': name,
+                        'ph': 'X',
+                        'ts': start * 1000000,
+                        'dur': duration * 1000000,
+                        'pid': 1,
+                        'tid': thread
+                        })
+    with open(path, 'w') as trace:
+        json.dump({'traceEvents': events}, trace)
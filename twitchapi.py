@@ -4,49 +4,173 @@ import os
 import sys
 import re
 import json
+import csv
+import copy
+import stat as stat_module
+import tempfile
+import threading
 import subprocess
 import time
-import base64
+import struct
+import atexit
 from datetime import datetime
-import encoded_images
+from collections import namedtuple, OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor
+import helix
+import history
+from tracing import traced
+
+# Parsed config.json, keyed on the file's path, mtime and size:
+config_cache = {'key': None, 'config': None}
+config_lock = threading.RLock()
+
+def load_config():
+    '''Return the cache key and the parsed wtwitch config, read together
+    under config_lock. The file is only parsed again, when its mtime or size
+    changed. The returned dict is shared, don't modify it.
+    '''
+    path = wtwitch_config_file()
+    with config_lock:
+        stat = os.stat(path)
+        key = path, stat.st_mtime_ns, stat.st_size
+        if config_cache['key'] != key:
+            with open(path, 'r') as config:
+                config_cache['config'] = json.load(config)
+            config_cache['key'] = key
+        return config_cache['key'], config_cache['config']
+
+def update_config(change):
+    '''Apply change() to a copy of the current config and write it atomically
+    with a temp file and rename. The config is reloaded first, if wtwitch
+    changed it outside the GUI, so those changes are kept.
+    '''
+    path = wtwitch_config_file()
+    with config_lock:
+        config = copy.deepcopy(load_config()[1])
+        change(config)
+        write_json_atomic(path, config)
+        stat = os.stat(path)
+        config_cache['key'] = path, stat.st_mtime_ns, stat.st_size
+        config_cache['config'] = config
+
+def write_json_atomic(path, data):
+    '''Write data to a temp file next to path and rename it over path, so
+    readers never see a half written file. Keeps the file's permissions.
+    '''
+    if os.path.isfile(path):
+        mode = stat_module.S_IMODE(os.stat(path).st_mode)
+    else:
+        mode = 0o644
+    fd, temp_path = tempfile.mkstemp(dir=os.path.dirname(path),
+                                    prefix='.tmp-', suffix='.json')
+    try:
+        with os.fdopen(fd, 'w') as new_file:
+            json.dump(data, new_file)
+        os.chmod(temp_path, mode)
+        os.replace(temp_path, path)
+    except:
+        os.remove(temp_path)
+        raise
 
 def check_config():
-    with open(wtwitch_config_file(), 'r') as config:
-        config = json.load(config)
-        player = config['player']
-        quality = config['quality']
-        colors = config['colors']
-        print_offline_subs = config['printOfflineSubscriptions']
+    config = load_config()[1]
+    player = config['player']
+    quality = config['quality']
+    colors = config['colors']
+    print_offline_subs = config['printOfflineSubscriptions']
     return player, quality, colors, print_offline_subs
 
 def adjust_config(setting, new_value):
-    with open(wtwitch_config_file(), 'r') as config:
-        config = json.load(config)
-    config[setting] = new_value
-    with open(wtwitch_config_file(), 'w') as nconfig:
-        json.dump(config, nconfig)
+    def change(config):
+        config[setting] = new_value
+    update_config(change)
 
 def follow_streamer(s):
-    new_entry = {'streamer': s}
-    with open(wtwitch_config_file(), 'r') as config:
-        config = json.load(config)
-    if new_entry not in config['subscriptions']:
-        config['subscriptions'].append(new_entry)
-    with open(wtwitch_config_file(), 'w') as nconfig:
-        json.dump(config, nconfig)
+    follow_streamers([s])
 
 def unfollow_streamer(s):
-    with open(wtwitch_config_file(), 'r') as config:
-        config = json.load(config)
-    new_subscriptions = []
-    for i in config['subscriptions']:
-        if i['streamer'] == s:
-            continue
+    unfollow_streamers([s])
+
+def follow_streamers(names):
+    '''Add the streamers to the follow list with one write of config.json.
+    Names that are already followed, in any case, are skipped. Returns the
+    added names.
+    '''
+    added = []
+    def change(config):
+        followed = {i['streamer'].lower() for i in config['subscriptions']}
+        for name in names:
+            name = name.strip()
+            if name and name.lower() not in followed:
+                followed.add(name.lower())
+                config['subscriptions'].append({'streamer': name})
+                added.append(name)
+    update_config(change)
+    return added
+
+def unfollow_streamers(names):
+    '''Remove the streamers from the follow list with one write of
+    config.json. Returns the removed names.
+    '''
+    unfollowed = {name.strip().lower() for name in names}
+    removed = []
+    def change(config):
+        new_subscriptions = []
+        for i in config['subscriptions']:
+            if i['streamer'].lower() in unfollowed:
+                removed.append(i['streamer'])
+            else:
+                new_subscriptions.append(i)
+        config['subscriptions'] = new_subscriptions
+    update_config(change)
+    return removed
+
+def followed_streamers():
+    return [i['streamer'] for i in load_config()[1]['subscriptions']]
+
+def read_follow_list(path):
+    '''Return the streamer names in a follow list file. JSON files hold a
+    list of names, a list of {"streamer": name} entries or a whole wtwitch
+    config. CSV files have the names in their first column, or in a column
+    named streamer or login. Other files have one name per line, lines
+    starting with # are skipped.
+    '''
+    extension = os.path.splitext(path)[1].lower()
+    with open(path, newline='', encoding='utf-8') as follow_list:
+        if extension == '.json':
+            data = json.load(follow_list)
+            if isinstance(data, dict):
+                data = data.get('subscriptions', [])
+            return [i['streamer'] if isinstance(i, dict) else str(i)
+                    for i in data]
+        if extension == '.csv':
+            rows = [row for row in csv.reader(follow_list) if row]
+            if not rows:
+                return []
+            header = [column.strip().lower() for column in rows[0]]
+            for column_name in ['streamer', 'login']:
+                if column_name in header:
+                    column = header.index(column_name)
+                    return [row[column] for row in rows[1:]
+                            if len(row) > column]
+            return [row[0] for row in rows]
+        return [line.strip() for line in follow_list
+                if line.strip() and not line.lstrip().startswith('#')]
+
+def write_follow_list(path, names):
+    '''Write the names as JSON, CSV or plain text, depending on the file
+    extension, in the formats that read_follow_list() reads.
+    '''
+    extension = os.path.splitext(path)[1].lower()
+    with open(path, 'w', newline='', encoding='utf-8') as follow_list:
+        if extension == '.json':
+            json.dump(list(names), follow_list, indent=2)
+        elif extension == '.csv':
+            writer = csv.writer(follow_list)
+            writer.writerow(['streamer'])
+            writer.writerows([name] for name in names)
         else:
-            new_subscriptions.append(i)
-    config['subscriptions'] = new_subscriptions
-    with open(wtwitch_config_file(), 'w') as nconfig:
-        json.dump(config, nconfig)
+            follow_list.writelines(f'{name}\n' for name in names)
 
 def wtwitch_config_file():
     if 'APPDATA' in os.environ:
@@ -68,125 +192,686 @@ def wtwitch_subscription_cache():
     cachepath = os.path.join(cachehome, 'wtwitch/subscription-cache.json')
     return cachepath, cachehome
 
+# One followed streamer. Offline streamers have empty stream info. The
+# thumbnail_url has {width} and {height} placeholders:
+Streamer = namedtuple('Streamer',
+                    ['login', 'name', 'category', 'title', 'viewers', 'online',
+                    'thumbnail_url'],
+                    defaults=[''])
+
+# Last result of extract_streamer_status(), keyed on the cache and config
+# files' mtimes and sizes:
+status_cache = {'key': None, 'status': None}
+status_lock = threading.Lock()
+
+@traced('extract_streamer_status')
 def extract_streamer_status():
-    online_streamers = []
+    '''Return the online and offline streamers of the follow list as tuples
+    of Streamer records. The files are only parsed again, if the subscription
+    cache or the config changed.
+    '''
+    cache_path = wtwitch_subscription_cache()[0]
+    with status_lock:
+        # The config's key has to come with the subscriptions, an
+        # update_config() in between would cache them under the new key:
+        config_key, config = load_config()
+        subscriptions = config['subscriptions']
+        stat = os.stat(cache_path)
+        key = (cache_path, stat.st_mtime_ns, stat.st_size, config_key)
+        if status_cache['key'] != key:
+            with open(cache_path, 'r') as cache:
+                cachefile = json.load(cache)
+            status_cache['status'] = index_streamer_status(cachefile['data'],
+                                                            subscriptions)
+            status_cache['key'] = key
+        return status_cache['status']
+
+def index_streamer_status(streams, subscriptions):
+    '''Combine the streams data of the Twitch API with the follow list. Logins
+    are compared case insensitively through a dict of the followed logins.
+    '''
+    # The spelling of the follow list is the login in both online and
+    # offline records, so a streamer keeps one login when going live:
+    followed = {}
+    for diction in subscriptions:
+        followed.setdefault(diction['streamer'].lower(), diction['streamer'])
+    online_logins = set()
     online_package = []
+    for streamer in streams:
+        login = streamer['user_login'].lower()
+        if login not in followed or login in online_logins:
+            continue
+        online_logins.add(login)
+        online_package.append(Streamer(followed[login],
+                                        streamer['user_name'],
+                                        streamer['game_name'],
+                                        streamer['title'],
+                                        streamer['viewer_count'],
+                                        True,
+                                        streamer.get('thumbnail_url', '')
+                                        ))
     offline_streamers = []
-    with open(wtwitch_subscription_cache()[0], 'r') as cache:
-        cachefile = json.load(cache)
-        for streamer in cachefile['data']:
-            online_streamers.append(streamer['user_login'])
-            login = streamer['user_login']
-            name = streamer['user_name']
-            categ = streamer['game_name']
-            title = streamer['title']
-            views = streamer['viewer_count']
-            package = login,name,categ,title,views
-            online_package.append(package)
-    with open(wtwitch_config_file(), 'r') as config:
-        configfile = json.load(config)
-        subscriptions = configfile['subscriptions']
-        for diction in subscriptions:
-            streamer = diction['streamer']
-            if streamer not in online_streamers:
-                offline_streamers.append(streamer)
+    for diction in subscriptions:
+        streamer = diction['streamer']
+        if streamer.lower() not in online_logins:
+            online_logins.add(streamer.lower())
+            offline_streamers.append(Streamer(streamer, streamer,
+                                                '', '', 0, False))
     online_package.sort()
     offline_streamers.sort()
-    return online_package, offline_streamers
+    return tuple(online_package), tuple(offline_streamers)
+
+# Search indexes are built off the Tk thread, see search_index_async():
+index_worker = ThreadPoolExecutor(max_workers=1)
+
+def search_text(package):
+    return '\n'.join([package.login, package.name, package.category,
+                        package.title]).lower()
+
+def text_matches(text, query):
+    '''Queries of one or two letters match the start of a word, longer ones
+    match anywhere. The query has to be lower case.
+    '''
+    if len(query) < 3:
+        return any(word.startswith(query) for word in text.split())
+    return query in text
 
+def search_index(streamers):
+    '''Index the login, name, category and title of the Streamer records
+    for search_streamers(). Maps every trigram to the logins whose text
+    contains it, and the first one and two letters of every word to the
+    logins with such a word.
+    '''
+    texts = {}
+    trigrams = {}
+    prefixes = {}
+    for package in streamers:
+        text = search_text(package)
+        texts[package.login] = text
+        for i in range(len(text) - 2):
+            trigrams.setdefault(text[i:i + 3], set()).add(package.login)
+        for word in text.split():
+            prefixes.setdefault(word[:1], set()).add(package.login)
+            prefixes.setdefault(word[:2], set()).add(package.login)
+    return {'texts': texts, 'trigrams': trigrams, 'prefixes': prefixes}
+
+def search_index_async(streamers):
+    return index_worker.submit(search_index, streamers)
+
+def search_streamers(index, query):
+    '''Return the set of logins whose text matches the query, see
+    text_matches().
+    '''
+    query = query.strip().lower()
+    if len(query) < 3:
+        return index['prefixes'].get(query, set())
+    candidates = sorted((index['trigrams'].get(query[i:i + 3], set())
+                        for i in range(len(query) - 2)), key=len)
+    matches = set(candidates[0])
+    for logins in candidates[1:]:
+        matches &= logins
+        if not matches:
+            return matches
+    # Trigrams only narrow the candidates, the text has to contain the
+    # whole query:
+    texts = index['texts']
+    return {login for login in matches if query in texts[login]}
+
+# Timestamps of the lastSeen files, read with one directory scan. Rescanned
+# when the directory or the subscription cache changed, at most once per
+# last_seen_check_interval seconds:
+last_seen_index = {'key': None, 'checked': 0, 'files': {}, 'timestamps': {}}
+last_seen_lock = threading.Lock()
+last_seen_check_interval = 1
+
+def last_seen_dir():
+    return f'{wtwitch_subscription_cache()[1]}/wtwitch/lastSeen'
+
+def last_seen_timestamps():
+    '''Return the lastSeen unix timestamps of all streamers, keyed by login.
+    wtwitch c rewrites lastSeen files along with the subscription cache, so
+    a changed cache or directory mtime triggers a rescan. Files whose mtime
+    didn't change aren't read again.
+    '''
+    with last_seen_lock:
+        if time.time() - last_seen_index['checked'] < last_seen_check_interval:
+            return last_seen_index['timestamps']
+        last_seen_index['checked'] = time.time()
+        path = last_seen_dir()
+        try:
+            dir_mtime = os.stat(path).st_mtime_ns
+        except OSError:
+            last_seen_index['files'] = {}
+            last_seen_index['timestamps'] = {}
+            return last_seen_index['timestamps']
+        try:
+            cache_mtime = os.stat(wtwitch_subscription_cache()[0]).st_mtime_ns
+        except OSError:
+            cache_mtime = None
+        key = path, dir_mtime, cache_mtime
+        if last_seen_index['key'] != key:
+            old_files = last_seen_index['files']
+            files = {}
+            with os.scandir(path) as entries:
+                for entry in entries:
+                    if not entry.is_file():
+                        continue
+                    mtime = entry.stat().st_mtime_ns
+                    known = old_files.get(entry.name)
+                    if known is not None and known[0] == mtime:
+                        files[entry.name] = known
+                        continue
+                    try:
+                        with open(entry.path) as lastseen:
+                            files[entry.name] = mtime, int(lastseen.read())
+                    except (OSError, ValueError):
+                        continue
+            last_seen_index['files'] = files
+            last_seen_index['timestamps'] = {name: ts for name, (mtime, ts)
+                                                in files.items()}
+            last_seen_index['key'] = key
+        return last_seen_index['timestamps']
+
+@traced('last_seen')
 def last_seen(s):
-    lastseen_dir = f'{wtwitch_subscription_cache()[1]}/wtwitch/lastSeen/{s}'
-    try:
-        with open(lastseen_dir) as lastseen:
-            ts = int(lastseen.read())
-            ts = datetime.utcfromtimestamp(ts)
-            ts = ts.strftime('%Y-%m-%d - %H:%M')
-            return ts
-    except:
+    ts = last_seen_timestamps().get(s)
+    if ts is None:
         return 'unknown'
+    ts = datetime.utcfromtimestamp(ts)
+    return ts.strftime('%Y-%m-%d - %H:%M')
 
-def check_status():
-    '''Call wtwitch c again when pressing the refresh button
+def sort_by_last_seen(streamers):
+    '''Sort streamer logins by their lastSeen time, most recent first.
+    Streamers that were never seen come last.
     '''
-    subprocess.run(['wtwitch', 'c'],
+    timestamps = last_seen_timestamps()
+    return sorted(streamers, key=lambda s: -timestamps.get(s, 0))
+
+def sort_streamers(status, mode='name'):
+    '''Return the logins of the (online, offline) status in the sort mode:
+    'name', 'viewers' (most first), 'category' or 'last_seen' (most recently
+    seen offline streamers first). Online streamers always come first.
+    '''
+    online, offline = status
+    if mode == 'viewers':
+        online = sorted(online, key=lambda s: (-s.viewers, s.login.lower()))
+    elif mode == 'category':
+        online = sorted(online, key=lambda s: (s.category.lower(),
+                                                s.login.lower()))
+    offline_logins = [package.login for package in offline]
+    if mode == 'last_seen':
+        offline_logins = sort_by_last_seen(offline_logins)
+    return [package.login for package in online] + offline_logins
+
+# Every wtwitch run goes through the broker. Runs with the same arguments
+# share one future while they are in flight, and at most broker_max_workers
+# wtwitch processes run at once. Players are only spawned, not waited for.
+broker_max_workers = 4
+broker_worker = ThreadPoolExecutor(max_workers=broker_max_workers)
+broker_jobs = {}
+broker_lock = threading.Lock()
+# Durations of the last 100 runs, keyed by wtwitch subcommand:
+command_latency = {}
+
+def run_wtwitch(command):
+    return subprocess.run(command,
                     capture_output=True,
-                    text=True
+                    text=True,
+                    check=True
                     )
 
-def fetch_vods(streamer):
-    '''Run wtwitch v and extract all timestamps/titles of the streamer's VODs
-    with regex. Cap the title length at 50 characters.
-    '''
-    # Make sure vods directory exists:
-    if not os.path.isdir(f'{sys.path[0]}/vods'):
-        os.makedirs(f'{sys.path[0]}/vods')
-    # Make sure the streamer's vods file exist and set it's age:
-    vods_file = f'{sys.path[0]}/vods/{streamer}.txt'
-    if not os.path.isfile(vods_file):
-        open(vods_file, 'a').close()
-        cache_age = 10000
-    else:
-        cache_modified = os.path.getmtime(vods_file)
-        cache_age = time.time() - cache_modified
-    # Only update the vods file, if it's new or older than 1 hour:
-    if cache_age > 3600:
-        wtwitch_v = subprocess.check_output(['wtwitch', 'v', streamer],
+def wtwitch_async(args, run=run_wtwitch):
+    '''Run wtwitch with args on the broker's pool. run gets the full command
+    and does the work, by default a subprocess.run() that raises on errors.
+    Returns the future of a run with the same args that is still in flight,
+    instead of starting another one.
+    '''
+    key = tuple(args)
+    with broker_lock:
+        job = broker_jobs.get(key)
+        if job is None:
+            job = broker_worker.submit(timed_run, key, run)
+            broker_jobs[key] = job
+            job.add_done_callback(lambda j: forget_broker_job(key, j))
+        return job
+
+def wtwitch(args, run=run_wtwitch):
+    return wtwitch_async(args, run).result()
+
+def wtwitch_popen(args, **kwargs):
+    '''Spawn wtwitch without waiting for it. Only the time to start the
+    process is recorded.
+    '''
+    started = time.perf_counter()
+    process = subprocess.Popen(['wtwitch', *args], **kwargs)
+    record_latency(args[0], time.perf_counter() - started)
+    return process
+
+def timed_run(key, run):
+    started = time.perf_counter()
+    try:
+        return run(['wtwitch', *key])
+    finally:
+        record_latency(key[0], time.perf_counter() - started)
+
+def forget_broker_job(key, job):
+    with broker_lock:
+        if broker_jobs.get(key) is job:
+            del broker_jobs[key]
+
+def record_latency(subcommand, duration):
+    with broker_lock:
+        if subcommand not in command_latency:
+            command_latency[subcommand] = deque(maxlen=100)
+        command_latency[subcommand].append(duration)
+
+def command_durations():
+    '''Return the durations of the recorded runs in seconds, keyed by
+    wtwitch subcommand.
+    '''
+    with broker_lock:
+        return {subcommand: list(durations)
+                for subcommand, durations in command_latency.items()}
+
+def command_stats():
+    '''Return the number of recorded runs and their mean and maximum duration
+    in seconds, keyed by wtwitch subcommand.
+    '''
+    with broker_lock:
+        return {subcommand: (len(durations),
+                            sum(durations) / len(durations),
+                            max(durations))
+                for subcommand, durations in command_latency.items()}
+
+@traced('check_status')
+def check_status():
+    '''Call wtwitch c again when pressing the refresh button. Raises
+    CalledProcessError, if wtwitch failed.
+    '''
+    wtwitch(['c'])
+
+# One worker, so that wtwitch c runs never overlap:
+status_worker = ThreadPoolExecutor(max_workers=1)
+
+def check_status_async():
+    '''Run wtwitch c and read the new status on a worker thread. Returns a
+    future, so the GUI can poll for the result without blocking the mainloop.
+    With the status_backend setting 'helix', the Twitch API is queried
+    directly and wtwitch c is only the fallback.
+    '''
+    def refresh():
+        status = None
+        helix_state['error'] = None
+        if get_setting('status_backend', 'wtwitch') == 'helix':
+            try:
+                status = helix_status()
+            except Exception as e:
+                helix_state['error'] = e
+        if status is None:
+            check_status()
+            status = extract_streamer_status()
+        record_history(status)
+        return status
+    return status_worker.submit(refresh)
+
+def load_history_async():
+    '''Read the history on the status worker, so it is done before the first
+    refresh records to it.
+    '''
+    return status_worker.submit(history.load)
+
+def record_history(status):
+    '''Append the viewer counts of the online streamers to the history,
+    unless the history setting is 'off'. A failed write doesn't fail the
+    refresh.
+    '''
+    if get_setting('history', 'on') == 'off':
+        return
+    try:
+        history.record(status[0])
+    except (OSError, ValueError, struct.error):
+        pass
+
+# The last error of the Helix backend, None after a successful query:
+helix_state = {'error': None}
+
+def helix_status():
+    '''Query the streams of all followed streamers from the Twitch API and
+    return them like extract_streamer_status(). The result is stored like
+    wtwitch c does, so the cached status and lastSeen stay current. Uses the
+    API token that wtwitch stores in its config, unless helix_token is set.
+    '''
+    config = load_config()[1]
+    subscriptions = config['subscriptions']
+    token = get_setting('helix_token', '') or config.get('apiToken')
+    client_id = get_setting('helix_client_id', '')
+    if not token or not client_id:
+        raise RuntimeError('helix_client_id and an API token are needed')
+    streams = helix.get_streams([diction['streamer']
+                                    for diction in subscriptions],
+                                client_id, token,
+                                get_setting('helix_url',
+                                            'https://api.twitch.tv/helix')
+                                )
+    try:
+        store_helix_status(streams, subscriptions)
+    except OSError:
+        pass
+    return index_streamer_status(streams, subscriptions)
+
+def store_helix_status(streams, subscriptions):
+    '''Write the streams to the subscription cache and touch the lastSeen
+    files of the online streamers, in the format of wtwitch c.
+    '''
+    cache_path = wtwitch_subscription_cache()[0]
+    os.makedirs(last_seen_dir(), exist_ok=True)
+    write_json_atomic(cache_path, {'data': streams})
+    online = {streamer['user_login'].lower() for streamer in streams}
+    now = str(int(time.time()))
+    for diction in subscriptions:
+        if diction['streamer'].lower() in online:
+            path = os.path.join(last_seen_dir(), diction['streamer'])
+            with open(path, 'w') as lastseen:
+                lastseen.write(now)
+
+# One VOD of a streamer. index is the number to pass to wtwitch v:
+Vod = namedtuple('Vod', ['index', 'timestamp', 'title', 'length'])
+
+# Parsed VOD caches of recently viewed streamers, least recent first:
+vod_memory = OrderedDict()
+vod_memory_lock = threading.Lock()
+# VODs parsed so far by running refreshes, keyed by streamer:
+vod_progress = {}
+# Prefetch pool. Its size limits how many broker workers the prefetch can
+# take, so there is room left for the VOD panel and refreshes:
+prefetch_state = {'worker': None, 'workers': None}
+
+def vods_dir():
+    return f'{sys.path[0]}/vods'
+
+def vods_cache_file(streamer):
+    return f'{vods_dir()}/{streamer}.json'
+
+# Number, timestamp, title and length of a VOD line of wtwitch v in one
+# match. The number may be colored, like the rest of the line:
+vod_pattern = re.compile(r'(?:(\d+)\.\s*(?:\x1b\[[0-9;]*m)*\s*)?'
+                        r'(\d{2}\S\d{2}.* \d{2}:\d{2})'
+                        r'.*?\x1b\[0m\s(.*?)\s\x1b\[93m'
+                        r'.*?(\d+h\d+m)')
+
+def parse_vods(lines, vods=None):
+    '''Extract the number, timestamp, title and length of every VOD line of
+    wtwitch v output in one pass. The index is the number wtwitch printed,
+    so a line the pattern misses doesn't shift the later VODs. Lines that
+    aren't VODs are skipped. Appends to vods, if given.
+    '''
+    if vods is None:
+        vods = []
+    for line in lines:
+        match = vod_pattern.search(line)
+        if match is not None:
+            number, timestamp, title, length = match.groups()
+            if number is not None:
+                index = int(number)
+            else:
+                index = vods[-1].index + 1 if vods else 1
+            vods.append(Vod(index, timestamp, title, length))
+    return vods
+
+def partial_vods(streamer):
+    '''Return the VODs parsed so far by a running refresh of the streamer, or
+    None if there is no refresh running.
+    '''
+    return vod_progress.get(streamer)
+
+@traced('cached_vods')
+def cached_vods(streamer, touch=True, remember=True):
+    '''Return the cached VODs of a streamer and whether they are older than
+    the vod_cache_ttl setting, without running wtwitch. Returns (None, True)
+    if nothing is cached. Freshness checks of the prefetch pass
+    remember=False, so they don't push viewed streamers out of vod_memory.
+    '''
+    with vod_memory_lock:
+        cachefile = vod_memory.get(streamer)
+        if cachefile is not None and remember:
+            vod_memory.move_to_end(streamer)
+    if cachefile is None:
+        try:
+            with open(vods_cache_file(streamer), 'r') as cache:
+                cachefile = json.load(cache)
+        except (OSError, ValueError):
+            return None, True
+        cachefile['vods'] = [Vod(*vod) for vod in cachefile['vods']]
+        if remember:
+            remember_vods(streamer, cachefile)
+    # The file's mtime marks the last access for the LRU eviction:
+    if touch:
+        try:
+            os.utime(vods_cache_file(streamer))
+        except OSError:
+            pass
+    age = time.time() - cachefile['fetched']
+    return cachefile['vods'], age > get_setting('vod_cache_ttl', 3600)
+
+def remember_vods(streamer, cachefile):
+    '''Keep the parsed VODs of the vod_memory_entries most recently used
+    streamers in memory.
+    '''
+    with vod_memory_lock:
+        vod_memory[streamer] = cachefile
+        vod_memory.move_to_end(streamer)
+        while len(vod_memory) > get_setting('vod_memory_entries', 20):
+            vod_memory.popitem(last=False)
+
+def update_vods(streamer, cachefile):
+    '''Replace the streamer's VODs in vod_memory, if they are there. Keeps
+    their place in the LRU order.
+    '''
+    with vod_memory_lock:
+        if streamer in vod_memory:
+            vod_memory[streamer] = cachefile
+
+@traced('refresh_vods')
+def refresh_vods(streamer, command):
+    '''Run wtwitch v, store the parsed VODs in the cache and return them.
+    The output is parsed line by line while wtwitch runs, partial_vods()
+    returns the VODs found so far.
+    '''
+    vods = []
+    vod_progress[streamer] = vods
+    try:
+        with subprocess.Popen(command,
+                            stdout=subprocess.PIPE,
                             text=True
-                            )
-        wtwitch_v = fr'{wtwitch_v}'
-        with open(vods_file, 'w') as vods:
-            vods.write(wtwitch_v)
-    # Retrieve relevant data from vods file and return it:
-    timestamps = []
-    titles = []
-    length = []
-    timestamp_pattern = re.compile(r'\d{2}\S\d{2}.* \d{2}:\d{2}')
-    titles_pattern = re.compile(r'(?<=\x1b\[0m\s)(.*?)(?=\s\x1b\[93m)')
-    length_pattern = re.compile(r'\d+h\d+m')
-    with open(vods_file, 'r') as vods:
-        for line in vods:
-            for match in timestamp_pattern.finditer(line):
-                timestamps.append(match.group())
-            for match in titles_pattern.finditer(line):
-                titles.append(match.group())
-            for match in length_pattern.finditer(line):
-                length.append(match.group())
-    return timestamps, titles, length
+                            ) as wtwitch_v:
+            parse_vods(wtwitch_v.stdout, vods)
+        if wtwitch_v.returncode != 0:
+            raise subprocess.CalledProcessError(wtwitch_v.returncode,
+                                                wtwitch_v.args)
+    finally:
+        del vod_progress[streamer]
+    os.makedirs(vods_dir(), exist_ok=True)
+    cachefile = {'fetched': time.time(), 'vods': vods}
+    write_json_atomic(vods_cache_file(streamer), cachefile)
+    # Refreshes also run for the prefetch, so only streamers that are
+    # already in memory are updated there. The VOD panel puts the rest in
+    # with cached_vods():
+    update_vods(streamer, cachefile)
+    evict_vods()
+    return vods
+
+def refresh_vods_async(streamer):
+    '''Refresh the streamer's VODs through the broker. A refresh that is
+    already running for the streamer is joined instead of starting another.
+    '''
+    return wtwitch_async(['v', streamer],
+                        lambda command: refresh_vods(streamer, command))
+
+def prefetch_vods(streamers):
+    '''Refresh the missing or stale VOD caches of the given streamers, with
+    at most vod_prefetch_workers of them waiting on the broker at once.
+    Returns the futures keyed by streamer. Only the vod_cache_max_files most
+    recently seen streamers are prefetched, so that evict_vods() doesn't
+    throw away what the prefetch just fetched.
+    '''
+    streamers = sort_by_last_seen(streamers)
+    del streamers[get_setting('vod_cache_max_files', 200):]
+    workers = get_setting('vod_prefetch_workers', 2)
+    if prefetch_state['workers'] != workers:
+        if prefetch_state['worker'] is not None:
+            prefetch_state['worker'].shutdown(wait=False)
+        prefetch_state['worker'] = ThreadPoolExecutor(max_workers=workers)
+        prefetch_state['workers'] = workers
+    jobs = {}
+    for streamer in streamers:
+        jobs[streamer] = prefetch_state['worker'].submit(prefetch_one,
+                                                        streamer)
+    return jobs
+
+def prefetch_one(streamer):
+    # Checked on the worker, since other refreshes may have run meanwhile:
+    if cached_vods(streamer, touch=False, remember=False)[1]:
+        refresh_vods_async(streamer).result()
+
+@traced('fetch_vods')
+def fetch_vods(streamer):
+    '''Return the streamer's VODs from the cache, or run wtwitch v if the
+    cache is missing or stale.
+    '''
+    vods, stale = cached_vods(streamer)
+    if stale:
+        vods = refresh_vods_async(streamer).result()
+    return vods
+
+def evict_vods():
+    '''Delete the least recently used VOD cache files, until there are at most
+    vod_cache_max_files files with at most vod_cache_max_bytes in total.
+    '''
+    max_files = get_setting('vod_cache_max_files', 200)
+    max_bytes = get_setting('vod_cache_max_bytes', 5000000)
+    cache_files = []
+    total_size = 0
+    with os.scandir(vods_dir()) as entries:
+        for entry in entries:
+            if entry.is_file() and not entry.name.startswith('.tmp-'):
+                # Concurrent evictions delete each other's files:
+                try:
+                    stat = entry.stat()
+                except FileNotFoundError:
+                    continue
+                cache_files.append((stat.st_mtime, stat.st_size, entry.path))
+                total_size += stat.st_size
+    cache_files.sort()
+    file_count = len(cache_files)
+    for mtime, size, path in cache_files:
+        if file_count <= max_files and total_size <= max_bytes:
+            break
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+        file_count -= 1
+        total_size -= size
+
+# Running players, keyed by ('stream', streamer) or ('vod', streamer, index):
+players = {}
 
 def start_vod(s, v):
-    subprocess.run(['wtwitch', 'v', s, str(v)])
+    return start_player(('vod', s, v), ['v', s, str(v)])
 
 def start_stream(s):
-    subprocess.run(['wtwitch', 'w', s])
-
-def icon_paths():
-    if not os.path.isdir(f'{sys.path[0]}/icons'):
-        os.makedirs(f'{sys.path[0]}/icons')
-    icon_dir_path = f'{sys.path[0]}/icons'
-
-    icon_file_paths = {}
-    for name in encoded_images.images:
-        if not os.path.isfile(f'{icon_dir_path}/{name}.png'):
-            with open(f'{icon_dir_path}/{name}.png', "wb") as icon_file:
-                icon_data = base64.b64decode(encoded_images.images[name])
-                icon_file.write(icon_data)
-        icon_file_paths[name] = f'{icon_dir_path}/{name}.png'
-    return icon_file_paths
+    return start_player(('stream', s), ['w', s])
+
+def start_player(key, args):
+    '''Start wtwitch and the player in their own session, without waiting for
+    them. Returns False, if the stream or VOD is already playing.
+    '''
+    process = players.get(key)
+    if process is not None and process.poll() is None:
+        return False
+    players[key] = wtwitch_popen(args,
+                        stdin=subprocess.DEVNULL,
+                        stdout=subprocess.DEVNULL,
+                        stderr=subprocess.DEVNULL,
+                        start_new_session=True
+                        )
+    return True
+
+def reap_players():
+    '''Forget the players that exited and return their keys.
+    '''
+    finished = [key for key, process in players.items()
+                if process.poll() is not None]
+    for key in finished:
+        del players[key]
+    return finished
+
+def playing_streams():
+    return {key[1] for key in players if key[0] == 'stream'}
+
+def icon_data(name):
+    '''Return the base64 encoded PNG data of an icon. encoded_images is only
+    imported when the first icon is needed.
+    '''
+    import encoded_images
+    return encoded_images.images[name]
+
+# settings.json is kept in memory. Changes are written in one batch, after
+# settings_save_delay seconds without further changes, and at exit:
+settings = {}
+settings_state = {'loaded': False, 'dirty': False, 'timer': None}
+settings_lock = threading.RLock()
+settings_save_delay = 2
+
+def settings_file():
+    return f'{sys.path[0]}/settings.json'
 
 def create_settings_file():
     default_settings = '{"show_info": "no", "show_info_preset": "online"}'
-    if not os.path.isfile(f'{sys.path[0]}/settings.json'):
-        with open(f'{sys.path[0]}/settings.json', 'w') as settings:
-            settings.write(default_settings)
+    if not os.path.isfile(settings_file()):
+        with open(settings_file(), 'w') as settings_json:
+            settings_json.write(default_settings)
+
+def load_settings():
+    with settings_lock:
+        if not settings_state['loaded']:
+            with open(settings_file(), 'r') as settings_json:
+                settings.update(json.load(settings_json))
+            settings_state['loaded'] = True
+        return settings
 
 def change_settings_file(setting, new_value):
-    with open(f'{sys.path[0]}/settings.json', 'r') as settings:
-        settings = json.load(settings)
-    settings[setting] = new_value
-    with open(f'{sys.path[0]}/settings.json', 'w') as nsettings:
-        json.dump(settings, nsettings)
-
-def get_setting(k):
-    with open(f'{sys.path[0]}/settings.json', 'r') as settings:
-        settings = json.load(settings)
-    return settings[k]
\ No newline at end of file
+    with settings_lock:
+        load_settings()
+        if settings.get(setting) == new_value:
+            return
+        settings[setting] = new_value
+        settings_state['dirty'] = True
+        # Restart the debounce timer:
+        if settings_state['timer'] is not None:
+            settings_state['timer'].cancel()
+        timer = threading.Timer(settings_save_delay, save_settings)
+        timer.daemon = True
+        timer.start()
+        settings_state['timer'] = timer
+
+def save_settings():
+    '''Write pending settings changes to settings.json.
+    '''
+    with settings_lock:
+        if settings_state['timer'] is not None:
+            settings_state['timer'].cancel()
+            settings_state['timer'] = None
+        if not settings_state['dirty']:
+            return
+        write_json_atomic(settings_file(), settings)
+        settings_state['dirty'] = False
+
+def get_setting(k, default=None):
+    with settings_lock:
+        load_settings()
+        if default is None:
+            return settings[k]
+        return settings.get(k, default)
+
+atexit.register(save_settings)